@@ -0,0 +1,68 @@
+# -*- coding:utf-8 -*-
+
+import math
+
+class MtimeComparator:
+    """Détermine le plus récent de deux fichiers situés de chaque côté.
+
+    Les dates de modification sont ramenées en UTC (décalage configuré des
+    serveurs FTP ne respectant pas la norme MLSD) puis tronquées à la
+    précision la plus grossière des deux systèmes de fichiers : une date
+    locale à la nanoseconde et la même date relevée à la seconde sur un
+    serveur FTP sont donc égales. Deux dates dont l'écart ne dépasse pas la
+    tolérance sont considérées comme identiques. Si les dates sont
+    identiques, le fichier le plus gros est le plus récent, et deux fichiers
+    de même taille sont identiques.
+    """
+
+    def __init__(self, leftFs, rightFs, tolerance=0, ftpUtcOffset=0):
+        self.precision = max(leftFs.mtimePrecision, rightFs.mtimePrecision)
+        self.tolerance = tolerance
+        self.offsets = {
+            "left": self._offset(leftFs, ftpUtcOffset),
+            "right": self._offset(rightFs, ftpUtcOffset)
+        }
+        self.avoided = 0
+
+    def key(self, side):
+        """Renvoie la fonction normalisant une date de modification du côté side."""
+        offset = self.offsets[side]
+        precision = self.precision
+
+        if precision:
+            return lambda mdate: math.floor((mdate + offset) / precision) * precision
+
+        return lambda mdate: mdate + offset
+
+    def compare(self, leftStat, rightStat):
+        """Renvoie 1 si le fichier de gauche est le plus récent, -1 si c'est
+        celui de droite et 0 s'ils sont identiques."""
+        leftMdate = self.key("left")(leftStat["mdate"])
+        rightMdate = self.key("right")(rightStat["mdate"])
+        delta = leftMdate - rightMdate
+
+        if delta > self.tolerance:
+            result = 1
+        elif delta < -self.tolerance:
+            result = -1
+        elif leftStat["size"] != rightStat["size"]:
+            result = 1 if leftStat["size"] > rightStat["size"] else -1
+        else:
+            result = 0
+
+        # Transfert qu'aurait provoqué une comparaison brute des dates
+        if result == 0 and leftStat["mdate"] != rightStat["mdate"]:
+            self.avoided = self.avoided + 1
+
+        return result
+
+    def convert(self, mdate, fromSide, toSide):
+        """Convertit une date de modification d'un côté vers l'autre."""
+        return mdate + self.offsets[fromSide] - self.offsets[toSide]
+
+    def _offset(self, fs, ftpUtcOffset):
+        if fs.local:
+            return 0
+
+        # Secondes à ajouter aux dates du serveur pour obtenir des dates UTC
+        return -ftpUtcOffset * 3600
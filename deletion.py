@@ -0,0 +1,165 @@
+# -*- coding:utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+import threading
+import time
+
+class DeletionEngine:
+    """Suppression en parallèle de fichiers et dossiers connus par le parcours.
+
+    Les fichiers sont supprimés par plusieurs sessions du système de fichiers
+    (une connexion FTP par session), puis les dossiers sont supprimés du plus
+    profond au moins profond, sans nouveau listing. Un dossier qui ne peut
+    pas être supprimé (il contient par exemple des fichiers exclus du
+    parcours) est supprimé avec rmtree par le thread appelant, une fois les
+    suppressions parallèles de son niveau terminées.
+
+    Les mêmes threads, et donc les mêmes sessions, servent à toutes les
+    suppressions : le nombre de connexions FTP ouvertes est borné par
+    workers.
+
+    Si ignoreMissing est vrai, un fichier déjà absent est considéré comme
+    supprimé : c'est le cas des fichiers connus par un manifeste périmé.
+    """
+
+    def __init__(self, fs, workers=4, log=None, ignoreMissing=False):
+        self.fs = fs
+        self.workers = max(1, workers)
+        self.ignoreMissing = ignoreMissing
+        self.deleted = 0
+        self.duration = 0
+
+        if not log:
+            log = logging.getLogger("null")
+            log.addHandler(logging.NullHandler())
+
+        self.log = log
+
+        self._local = threading.local()
+        self._sessions = list()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def deleteFiles(self, paths, callback=None):
+        """Supprime les fichiers. callback est appelé pour chaque fichier supprimé."""
+        def deleteFile(path):
+            try:
+                self._session().delete(path)
+            except Exception as e:
+                if not (self.ignoreMissing and isMissing(e)):
+                    raise
+
+                self.log.debug("Fichier {path} déjà supprimé ({error}).".format(
+                    path=path, error=e))
+
+            return path
+
+        return self._run(sorted(paths), deleteFile, callback)
+
+    def deleteDirs(self, paths, callback=None):
+        """Supprime les dossiers, par niveau de profondeur décroissant.
+
+        callback est appelé pour chaque dossier supprimé.
+        """
+        levels = dict()
+
+        for path in paths:
+            levels.setdefault(path.count("/"), list()).append(path)
+
+        failed = list()
+
+        def deleteDir(path):
+            try:
+                self._session().rmdir(path)
+            except Exception as e:
+                self.log.debug("Dossier non vide {path} ({error}), suppression "
+                    "de son arborescence...".format(path=path, error=e))
+                failed.append(path)
+
+                return None
+
+            return path
+
+        deleted = 0
+
+        for depth in sorted(levels, reverse=True):
+            deleted = deleted + self._run(sorted(levels[depth]), deleteDir, callback)
+
+            # rmtree utilise la connexion principale du système de fichiers,
+            # qui ne peut pas être partagée entre les threads
+            start = time.time()
+
+            for path in failed:
+                self.fs.rmtree(path)
+                deleted = deleted + 1
+
+                if callback:
+                    callback(path)
+
+            self.deleted = self.deleted + len(failed)
+            self.duration = self.duration + time.time() - start
+            failed[:] = list()
+
+        return deleted
+
+    def close(self):
+        """Arrête les tâches de suppression et ferme leurs sessions."""
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+        for session in self._sessions:
+            session.close()
+
+        self._sessions = list()
+        self._local = threading.local()
+
+    def report(self):
+        """Renvoie le nombre d'éléments supprimés par seconde."""
+        return "{deleted} élément(s) supprimé(s) en {duration:.1f}s ({rate:.0f}/s).".format(
+            deleted=self.deleted,
+            duration=self.duration,
+            rate=self.deleted / self.duration if self.duration else 0)
+
+    def _run(self, paths, function, callback):
+        if not paths:
+            return 0
+
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        start = time.time()
+        deleted = 0
+
+        for path in self._executor.map(function, paths):
+            if path is None:
+                continue
+
+            deleted = deleted + 1
+
+            if callback:
+                callback(path)
+
+        self.deleted = self.deleted + deleted
+        self.duration = self.duration + time.time() - start
+
+        return deleted
+
+    def _session(self):
+        """Session propre à la tâche courante, ouverte à sa première utilisation."""
+        session = getattr(self._local, "session", None)
+
+        if session is None:
+            session = self.fs.openSession()
+            self._local.session = session
+
+            with self._lock:
+                self._sessions.append(session)
+
+        return session
+
+def isMissing(error):
+    """Retourne vrai si l'erreur indique un fichier absent (550 pour FTP)."""
+    return isinstance(error, FileNotFoundError) or str(error).startswith("550")
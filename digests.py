@@ -0,0 +1,202 @@
+# -*- coding:utf-8 -*-
+
+import filesystem
+import gzip
+import hashlib
+import json
+import os
+import os.path
+import posixpath
+
+def buildTree(files, dirs):
+    """Regroupe les chemins relatifs par dossier parent.
+
+    Renvoie un dictionnaire dont la clé est le chemin relatif d'un dossier
+    ("" pour la racine) et la valeur un tuple (sous-dossiers, fichiers) de
+    listes de chemins relatifs.
+    """
+    tree = {"": (list(), list())}
+
+    for path in dirs:
+        tree.setdefault(path, (list(), list()))
+
+    for path in dirs:
+        tree.setdefault(posixpath.dirname(path), (list(), list()))[0].append(path)
+
+    for path in files:
+        tree.setdefault(posixpath.dirname(path), (list(), list()))[1].append(path)
+
+    return tree
+
+def listingHash(entries):
+    """Empreinte du contenu direct d'un dossier.
+
+    entries est une liste de tuples (nom, type, taille, date de
+    modification) des entrées d'un seul listing.
+    """
+    digest = hashlib.sha1()
+
+    for entry in sorted(entries):
+        digest.update(repr(entry).encode("utf-8", "surrogateescape"))
+
+    return digest.hexdigest()
+
+def computeDigests(files, dirs, mtimeKey=None):
+    """Calcule l'empreinte agrégée de chaque dossier, des feuilles vers la racine.
+
+    Renvoie un tuple (digests, tree) où digests associe à chaque dossier un
+    tuple (nombre d'entrées, taille totale, empreinte) de son arborescence.
+    L'empreinte porte sur les tuples (nom, taille, date de modification) des
+    fichiers et sur les empreintes des sous-dossiers : deux dossiers de même
+    empreinte ont donc le même contenu, sous-dossiers compris.
+
+    mtimeKey, si elle est fournie, normalise les dates de modification avant
+    leur prise en compte (voir compare.MtimeComparator.key) : deux
+    arborescences identiques relevées avec des précisions différentes ont
+    alors les mêmes empreintes.
+    """
+    tree = buildTree(files, dirs)
+    digests = dict()
+
+    # Les dossiers les plus profonds sont traités en premier
+    paths = sorted(tree, key=lambda path: path.count("/") + (1 if path else 0),
+        reverse=True)
+
+    for path in paths:
+        subdirs, subfiles = tree[path]
+        count = len(subfiles) + len(subdirs)
+        size = 0
+        entries = list()
+
+        for _file in subfiles:
+            stat = files[_file]
+            size = size + stat["size"]
+            mdate = mtimeKey(stat["mdate"]) if mtimeKey else stat["mdate"]
+            entries.append((posixpath.basename(_file), "f", stat["size"], mdate))
+
+        for _dir in subdirs:
+            subcount, subsize, subdigest = digests[_dir]
+            count = count + subcount
+            size = size + subsize
+            entries.append((posixpath.basename(_dir), "d", subsize, subdigest))
+
+        digests[path] = (count, size, listingHash(entries))
+
+    return digests, tree
+
+class DigestCache:
+    """Résultats de parcours conservés d'une exécution à l'autre.
+
+    Pour chaque dossier distant sont conservés les fichiers, les dossiers
+    et l'empreinte du listing de chaque dossier. Au parcours suivant, un
+    dossier dont le listing est identique n'est pas parcouru : le contenu de
+    ses sous-dossiers est repris du cache. Un ajout ou une suppression dans
+    un dossier ne modifie que la date de ce dossier, donc seulement le
+    listing de son parent : une modification plus profonde, comme un fichier
+    remplacé sur place, n'est pas détectée. Le cache n'est donc utilisé que
+    pour le dossier de droite, qui ne doit être modifié que par cet outil, et
+    son entrée est supprimée avant toute modification (voir Sync).
+    """
+
+    def __init__(self, filename, rules=None):
+        self.filename = filename
+        self.rules = list(rules or list())
+        self._sides = dict()
+
+    def load(self):
+        """Charge le cache. Il est ignoré si les filtres ont changé."""
+        self._sides = dict()
+
+        if not os.path.exists(self.filename):
+            return self
+
+        try:
+            with gzip.open(self.filename, "rt", encoding="utf-8") as fd:
+                content = json.load(fd)
+        except (OSError, ValueError):
+            return self
+
+        if content.get("rules") != self.rules:
+            return self
+
+        for key, side in content.get("sides", dict()).items():
+            self._sides[key] = CachedTree(side)
+
+        return self
+
+    def save(self):
+        content = {
+            "rules": self.rules,
+            "sides": {key: side.content for key, side in self._sides.items()}
+        }
+
+        tmpFilename = self.filename + ".tmp"
+
+        with gzip.open(tmpFilename, "wt", encoding="utf-8") as fd:
+            json.dump(content, fd)
+
+        os.replace(tmpFilename, self.filename)
+
+        return self
+
+    def get(self, basepath):
+        """Arborescence conservée pour le dossier basepath, ou None."""
+        return self._sides.get(self._key(basepath))
+
+    def discard(self, basepath):
+        """Oublie l'arborescence conservée pour le dossier basepath."""
+        self._sides.pop(self._key(basepath), None)
+
+        return self
+
+    def update(self, syncDirectory):
+        """Enregistre l'état courant d'un dossier."""
+        content = {
+            "files": {path: [stat["size"], stat["mdate"]]
+                for path, stat in syncDirectory.files.items()},
+            "dirs": {path: [stat["size"], stat["mdate"], syncDirectory.listings.get(path)]
+                for path, stat in syncDirectory.dirs.items()},
+            "root": syncDirectory.listings.get("")
+        }
+
+        self._sides[self._key(syncDirectory.basepath)] = CachedTree(content)
+
+        return self
+
+    def _key(self, basepath):
+        # Le mot de passe éventuel de l'url n'est pas conservé
+        return filesystem.hidePassword(basepath)
+
+class CachedTree:
+    """Arborescence d'un dossier lors de l'exécution précédente."""
+
+    def __init__(self, content):
+        self.content = content
+        self.files = {path: {"size": size, "mdate": mdate}
+            for path, (size, mdate) in content["files"].items()}
+        self.dirs = {path: {"size": size, "mdate": mdate}
+            for path, (size, mdate, listing) in content["dirs"].items()}
+        self.listings = {path: listing
+            for path, (size, mdate, listing) in content["dirs"].items()}
+        self.listings[""] = content.get("root")
+        self.tree = buildTree(self.files, self.dirs)
+
+    def listing(self, path):
+        return self.listings.get(path)
+
+    def subtree(self, path):
+        """Parcourt les entrées conservées sous le dossier path.
+
+        Renvoie un générateur de tuples (chemin, est un dossier, stat).
+        """
+        stack = [path]
+
+        while stack:
+            subdirs, subfiles = self.tree.get(stack.pop(), (list(), list()))
+
+            for _dir in subdirs:
+                stack.append(_dir)
+                yield _dir, True, self.dirs[_dir]
+
+            for _file in subfiles:
+                yield _file, False, self.files[_file]
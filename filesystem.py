@@ -1,33 +1,98 @@
 # -*- coding:utf-8 -*-
 
 from abc import ABCMeta, abstractmethod
-from datetime import datetime
 
-import ftplib
-import ftputil
-import ftputil_custom
+import importlib
 import os
 import os.path
+import pipeline
 import posixpath
 import re
 import shutil
+import tempfile
+
+# Registre des systèmes de fichiers : liste de tuples (pattern compilé, nom du
+# module, nom de la classe). Le module n'est importé que lorsqu'un chemin
+# correspond au pattern, ce qui évite de charger ftputil pour une
+# synchronisation locale.
+_fileSystems = list()
+
+# Formats de chemins pris en charge, partagés par le registre et par les
+# classes des systèmes de fichiers
+WINDOWS_PATH_PATTERN = r"^[a-z]:[\\/].*"
+UNIX_PATH_PATTERN = r"/.*"
+FTP_PATH_PATTERN = r"^ftp://((.+):(.+)@)?([^:/]+)(:([0-9]{1,5}))?(/.*)?$"
+
+def registerFileSystem(pattern, module, className):
+    """Enregistre un système de fichiers pour les chemins reconnus par pattern."""
+    _fileSystems.append((re.compile(pattern, re.IGNORECASE), module, className))
 
 def getFileSystem(path):
-    fileSystems = [
-        WindowsFileSystem(),
-        UnixFileSystem(),
-        FTPFileSystem()
-    ]
+    for pattern, module, className in _fileSystems:
+        if pattern.match(path):
+            fsClass = getattr(importlib.import_module(module), className)
 
-    for fs in fileSystems:
-        if fs.isSupportedPath(path):
-            return fs.init(path)
+            return fsClass().init(path)
 
     return None
 
+def hidePassword(path):
+    """Retire le mot de passe éventuel d'une url, avant son enregistrement."""
+    return re.sub(r"^(ftp://[^:/@]+):[^@]*@", r"\1@", path, flags=re.IGNORECASE)
+
+def writeLocalFile(filename, content=None, fd_content=None, keepPartial=False):
+    """Écrit un fichier local à partir de content ou du fichier fd_content.
+
+    Le contenu est écrit dans un fichier temporaire du même dossier, qui
+    remplace le fichier cible une fois l'écriture terminée : une lecture
+    interrompue ne laisse ni fichier tronqué ni fichier cible modifié. Si
+    keepPartial est vrai (transfert enregistré dans le journal de reprise),
+    le fichier cible est écrit directement afin que sa partie transférée
+    serve à la reprise.
+    """
+    if keepPartial:
+        fd = open(filename, "wb")
+        tmpFilename = None
+    else:
+        dirname, basename = os.path.split(filename)
+        handle, tmpFilename = tempfile.mkstemp(
+            prefix="." + basename + ".", suffix=".part", dir=dirname or None)
+        fd = os.fdopen(handle, "wb")
+
+    try:
+        try:
+            if fd_content:
+                # Lecture et écriture recouvertes, à mémoire bornée
+                pipeline.copyStream(fd_content, fd)
+                fd_content.close()
+            else:
+                fd.write(content)
+        finally:
+            fd.close()
+    except BaseException:
+        if tmpFilename:
+            os.unlink(tmpFilename)
+
+        raise
+
+    if tmpFilename:
+        os.replace(tmpFilename, filename)
+
 class FileSystem(metaclass=ABCMeta):
-    def __init__(self):
-        self.supportedPathPatterns = list()
+    # Patterns compilés des chemins pris en charge
+    supportedPathPatterns = list()
+
+    # Vrai si les fichiers sont accessibles par un chemin local
+    local = False
+
+    # Vrai si le système de fichiers sait transférer un fichier par segments
+    # (méthodes download et upload)
+    segmentedTransfers = False
+
+    # Précision, en secondes, des dates de modification (0 si sous la seconde)
+    mtimePrecision = 0
+
+    def __init__(self): pass
 
     def isSupportedPath(self, path):
         """Retourne vrai si le format de chemin est pris en charge."""
@@ -43,7 +108,7 @@ class FileSystem(metaclass=ABCMeta):
         et l'objet ReMatch correspondant.
         """
         for pattern in self.supportedPathPatterns:
-            results = re.match(pattern, path, re.IGNORECASE)
+            results = pattern.match(path)
 
             if results:
                 return pattern, results
@@ -63,13 +128,16 @@ class FileSystem(metaclass=ABCMeta):
     def rmtree(self, path): pass
 
     @abstractmethod
-    def open(self, path, mode): pass
+    def open(self, path, mode, rest=None): pass
 
     @abstractmethod
     def read(self, filename): pass
 
     @abstractmethod
-    def write(self, filename, content=None, fd_content=None): pass
+    def write(self, filename, content=None, fd_content=None, keepPartial=False):
+        """Écrit un fichier. Sauf si keepPartial est vrai, une écriture
+        interrompue ne laisse pas de fichier partiel."""
+        pass
 
     @abstractmethod
     def delete(self, filename): pass
@@ -77,39 +145,97 @@ class FileSystem(metaclass=ABCMeta):
     @abstractmethod
     def stat(self, filename): pass
 
+    @abstractmethod
+    def isdir(self, path): pass
+
     @abstractmethod
     def utime(self, path, times): pass
 
     @abstractmethod
     def walk(self, path): pass
 
+    @abstractmethod
+    def listdir(self, path): 
+        """Contenu direct d'un dossier relatif.
+
+        Renvoie une liste de tuples (nom, est un dossier, taille).
+        """
+        pass
+
     @abstractmethod
     def init(self, path): pass
 
+    def close(self):
+        """Libère les ressources du système de fichiers."""
+        pass
+
+    def openSession(self):
+        """Ouvre une session utilisable par une tâche parallèle.
+
+        La session fournit les méthodes delete, rmdir et close. Par défaut,
+        elle délègue au système de fichiers lui-même.
+        """
+        return FileSystemSession(self)
+
+    def getsize(self, path):
+        """Taille actuelle du fichier (en octet), None s'il n'existe pas."""
+        return None
+
+    def resume(self, filename, fd_content, offset):
+        """Reprend l'écriture d'un fichier à la position offset.
+
+        Renvoie faux si la reprise n'est pas possible, le fichier devant alors
+        être réécrit entièrement.
+        """
+        return False
+
+class FileSystemSession:
+    """Session déléguant les opérations au système de fichiers."""
+
+    def __init__(self, fs):
+        self.fs = fs
+
+    def delete(self, filename):
+        self.fs.delete(filename)
+
+    def rmdir(self, path):
+        self.fs.rmdir(path)
+
+    def close(self): pass
+
 class WindowsFileSystem(FileSystem):
+    local = True
+
+    supportedPathPatterns = [
+        re.compile(WINDOWS_PATH_PATTERN, re.IGNORECASE)
+    ]
+
     def __init__(self):
         super().__init__()
 
-        self.supportedPathPatterns = [
-            "^[a-z]:[\\\/].*"
-        ]
-
     def mkdir(self, path): pass
 
     def makedirs(self, path):
         path = posixpath.join(self.basepath, path)
         os.makedirs(path, exist_ok=True)
 
-    def rmdir(self, path): pass
+    def rmdir(self, path):
+        path = posixpath.join(self.basepath, path)
+        os.rmdir(path)
 
     def rmtree(self, path): 
         path = posixpath.join(self.basepath, path)
         shutil.rmtree(path, ignore_errors=True)
 
-    def open(self, path, mode):
+    def open(self, path, mode, rest=None):
         path = posixpath.join(self.basepath, path)
 
-        return open(path, mode)
+        fd = open(path, mode)
+
+        if rest:
+            fd.seek(rest)
+
+        return fd
 
     def read(self, filename): 
         filename = posixpath.join(self.basepath, filename)
@@ -120,30 +246,44 @@ class WindowsFileSystem(FileSystem):
         
         return content
 
-    def write(self, filename, content=None, fd_content=None): 
-        if fd_content:
-            content = fd_content.read()
+    def write(self, filename, content=None, fd_content=None, keepPartial=False):
+        filename = posixpath.join(self.basepath, filename)
+        writeLocalFile(filename, content, fd_content, keepPartial)
 
+    def getsize(self, path):
+        path = posixpath.join(self.basepath, path)
+
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def resume(self, filename, fd_content, offset):
         filename = posixpath.join(self.basepath, filename)
-        
-        fd = open(filename, "wb")
-        fd.write(content)
-        fd.close()
+
+        fd = open(filename, "r+b")
+        fd.seek(offset)
+        fd.truncate()
+
+        try:
+            pipeline.copyStream(fd_content, fd)
+            fd_content.close()
+        finally:
+            fd.close()
+
+        return True
 
     def delete(self, filename): 
         filename = posixpath.join(self.basepath, filename)
         os.unlink(filename)
 
     def stat(self, path): 
-        stat = os.lstat(path)
-
-        # Modification de st_*time pour avoir des timestamps UTC
-        _stat = list(stat)
-        _stat[7] = datetime.utcfromtimestamp(_stat[7]).timestamp()
-        _stat[8] = datetime.utcfromtimestamp(_stat[8]).timestamp()
-        _stat[9] = datetime.utcfromtimestamp(_stat[9]).timestamp()
+        # Les dates st_*time sont déjà des timestamps UTC
+        return os.lstat(path)
 
-        return os.stat_result(_stat)
+    def isdir(self, path):
+        path = posixpath.join(self.basepath, path)
+        return os.path.isdir(path)
 
     def utime(self, path, times):
         path = posixpath.join(self.basepath, path)
@@ -152,6 +292,13 @@ class WindowsFileSystem(FileSystem):
     def walk(self, path):
         return os.walk(path)
 
+    def listdir(self, path):
+        path = posixpath.join(self.basepath, path)
+
+        with os.scandir(path) as entries:
+            return [(entry.name, entry.is_dir(follow_symlinks=False),
+                entry.stat(follow_symlinks=False).st_size) for entry in entries]
+
     def init(self, path): 
         """Initialise l'accès au système de fichiers."""
         self.basepath = path
@@ -159,27 +306,38 @@ class WindowsFileSystem(FileSystem):
         return self
 
 class UnixFileSystem(FileSystem):
+    local = True
+
+    supportedPathPatterns = [
+        re.compile(UNIX_PATH_PATTERN, re.IGNORECASE)
+    ]
+
     def __init__(self):
         super().__init__()
 
-        self.supportedPathPatterns = [
-            "/.*"
-        ]
-
     def mkdir(self, path): pass
 
     def makedirs(self, path): 
         path = posixpath.join(self.basepath, path)
         os.makedirs(path, exist_ok=True)
 
-    def rmdir(self, path): pass
+    def rmdir(self, path):
+        path = posixpath.join(self.basepath, path)
+        os.rmdir(path)
 
-    def rmtree(self, path): pass
+    def rmtree(self, path):
+        path = posixpath.join(self.basepath, path)
+        shutil.rmtree(path, ignore_errors=True)
 
-    def open(self, path, mode):
+    def open(self, path, mode, rest=None):
         path = posixpath.join(self.basepath, path)
 
-        return open(path, mode)
+        fd = open(path, mode)
+
+        if rest:
+            fd.seek(rest)
+
+        return fd
 
     def read(self, filename): 
         filename = posixpath.join(self.basepath, filename)
@@ -190,160 +348,65 @@ class UnixFileSystem(FileSystem):
         
         return content
 
-    def write(self, filename, content=None, fd_content=None):
-        if fd_content:
-            content = fd_content.read()
-
-        filename = posixpath.join(self.basepath, filename)
-        
-        fd = open(filename, "wb")
-        fd.write(content)
-        fd.close()
-
-    def delete(self, filename): 
+    def write(self, filename, content=None, fd_content=None, keepPartial=False):
         filename = posixpath.join(self.basepath, filename)
-        #os.unlink(filename)
+        writeLocalFile(filename, content, fd_content, keepPartial)
 
-    def stat(self, path):
-        stat = os.lstat(path)
-
-        # Modification de st_*time pour avoir des timestamps UTC
-        _stat = list(stat)
-        _stat[7] = datetime.utcfromtimestamp(_stat[7]).timestamp()
-        _stat[8] = datetime.utcfromtimestamp(_stat[8]).timestamp()
-        _stat[9] = datetime.utcfromtimestamp(_stat[9]).timestamp()
-        
-        return os.stat_result(_stat)
-
-    def utime(self, path, times):
+    def getsize(self, path):
         path = posixpath.join(self.basepath, path)
-        os.utime(path, times)
-
-    def walk(self, path):
-        return os.walk(path)
 
-    def init(self, path): 
-        """Initialise l'accès au système de fichiers."""
-        self.basepath = path
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
 
-        return self
+    def resume(self, filename, fd_content, offset):
+        filename = posixpath.join(self.basepath, filename)
 
-class FTPFileSystem(FileSystem):
-    def __init__(self):
-        super().__init__()
+        fd = open(filename, "r+b")
+        fd.seek(offset)
+        fd.truncate()
 
-        self.supportedPathPatterns = [
-            "^ftp://((.+):(.+)@)?([^:/]+)(:([0-9]{1,5}))?(/.+)*$"
-        ]
-        self._stat_cache = None
-        
-    def keep_alive(self, *args, **kwargs):
         try:
-            self.ftp.chdir(self.ftp.getcwd())
-        except ftputil.error.TemporaryError as e:
-            if "421" in str(e):
-                self.open_connection()
-        
-    def mkdir(self, path): pass
+            pipeline.copyStream(fd_content, fd)
+            fd_content.close()
+        finally:
+            fd.close()
 
-    def makedirs(self, path): 
-        self.keep_alive()
-        
-        path = posixpath.join(self.basepath, path)
-        try:
-            self.ftp._session.mkd(path)
-        except: pass
+        return True
 
-    def rmdir(self, path): pass
+    def delete(self, filename): 
+        filename = posixpath.join(self.basepath, filename)
+        os.unlink(filename)
 
-    def rmtree(self, path):
-        self.keep_alive()
-        
-        path = posixpath.join(self.basepath, path)
-        self.ftp.rmtree(path, ignore_errors=True)
+    def stat(self, path):
+        # Les dates st_*time sont déjà des timestamps UTC
+        return os.lstat(path)
 
-    def open(self, path, mode): 
-        self.keep_alive()
-        
+    def isdir(self, path):
         path = posixpath.join(self.basepath, path)
-
-        return self.ftp.open(path, "rb")
-
-    def read(self, filename): pass
-
-    def write(self, filename, content=None, fd_content=None):
-        self.keep_alive()
-        filename = posixpath.join(self.basepath, filename)
-        
-        fd = self.ftp.open(filename, "wb")
-        self.ftp.copyfileobj(fd_content, fd, callback=self.keep_alive)
-        fd_content.close()
-        fd.close()
-                
-    def delete(self, filename): 
-        self.keep_alive()
-        
-        filename = posixpath.join(self.basepath, filename)
-        self.ftp.unlink(filename)
+        return os.path.isdir(path)
 
     def utime(self, path, times):
-        self.keep_alive()
         path = posixpath.join(self.basepath, path)
+        os.utime(path, times)
 
-        mtime = datetime.utcfromtimestamp(times[1]).strftime("%Y%m%d%H%M%S")
-        
-        self.ftp._session.sendcmd("MFMT {mtime} {path}".format(
-            mtime=mtime,
-            path=path))
+    def walk(self, path):
+        return os.walk(path)
 
-    def stat(self, path):
-        return self.ftp.lstat(path)
+    def listdir(self, path):
+        path = posixpath.join(self.basepath, path)
 
-    def walk(self, path): 
-        return self.ftp.walk(path)
+        with os.scandir(path) as entries:
+            return [(entry.name, entry.is_dir(follow_symlinks=False),
+                entry.stat(follow_symlinks=False).st_size) for entry in entries]
 
-    def init(self, path):
+    def init(self, path): 
         """Initialise l'accès au système de fichiers."""
-        self.basepath = "/"
-
-        pattern, results = self.foundPathPattern(path)
-
-        self.user = "anonymous"
-        self.password = ""
-        self.port = 21
-
-        if results.group(2):
-            self.user = results.group(2)
-            self.password = results.group(3)
-
-        self.server = results.group(4)
-
-        if results.group(6):
-            self.port = int(results.group(6))
+        self.basepath = path
 
-        if results.group(7):
-            self.basepath = results.group(7)
-            
-        self.open_connection()
-            
         return self
-    
-    def open_connection(self):
-        self.ftp = ftputil.FTPHost(
-            host=self.server, 
-            port=self.port, 
-            user=self.user, 
-            password=self.password, 
-            session_factory=ftputil_custom.FTPSession)
-        
-        if self._stat_cache == None:
-            self._stat_cache = ftputil_custom._StatMLSD(self.ftp)
-        else:
-            _cache = self._stat_cache._lstat_cache
-            self._stat_cache = ftputil_custom._StatMLSD(self.ftp)
-            self._stat_cache._lstat_cache = _cache
-        
-        self.ftp._stat = self._stat_cache
-        self.ftp.chdir(self.basepath)
 
-        return self
+registerFileSystem(WINDOWS_PATH_PATTERN, "filesystem", "WindowsFileSystem")
+registerFileSystem(UNIX_PATH_PATTERN, "filesystem", "UnixFileSystem")
+registerFileSystem(FTP_PATH_PATTERN, "ftpfilesystem", "FTPFileSystem")
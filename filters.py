@@ -0,0 +1,164 @@
+# -*- coding:utf-8 -*-
+
+import re
+
+class PathFilter:
+    """Filtre d'inclusion/exclusion des chemins parcourus.
+
+    Les règles suivent la syntaxe des fichiers .gitignore :
+    - une ligne vide ou commençant par "#" est ignorée ;
+    - "!" en début de règle ré-inclut les chemins correspondants ;
+    - "/" en fin de règle ne s'applique qu'aux dossiers ;
+    - une règle contenant un "/" (hors dernier caractère) est ancrée à la
+      racine du dossier synchronisé, sinon elle s'applique au nom de l'entrée
+      quelle que soit sa profondeur ;
+    - "*" et "?" ne traversent pas les "/", "**" traverse les dossiers.
+
+    Une règle préfixée par "re:" est une expression régulière recherchée
+    dans le chemin relatif (les dossiers sont terminés par "/"). Les
+    références arrières numérotées n'y sont pas supportées.
+
+    Comme pour git, la dernière règle correspondante l'emporte. Toutes les
+    règles sont compilées en une seule expression régulière : les
+    alternatives sont placées dans l'ordre inverse afin que la première
+    alternative reconnue soit la dernière règle déclarée.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = list()
+        self._includes = dict()
+        self._regex = None
+
+        for rule in rules or list():
+            self.addRule(rule)
+
+    def __bool__(self):
+        return len(self.rules) > 0
+
+    def __str__(self):
+        return ", ".join(self.rules)
+
+    def addRule(self, rule):
+        """Ajoute une règle au filtre."""
+        rule = rule.rstrip("\n")
+
+        if not rule.strip() or rule.startswith("#"):
+            return self
+
+        self.rules.append(rule)
+        self._regex = None
+
+        return self
+
+    def load(self, filename):
+        """Charge les règles depuis un fichier au format .gitignore."""
+        with open(filename, "r", encoding="utf-8") as fd:
+            for line in fd:
+                self.addRule(line)
+
+        return self
+
+    def compile(self):
+        """Compile l'ensemble des règles en une seule expression régulière."""
+        alternatives = list()
+        self._includes = dict()
+
+        for index, rule in reversed(list(enumerate(self.rules))):
+            include = False
+
+            if rule.startswith("!"):
+                include = True
+                rule = rule[1:]
+            elif rule.startswith("\\!") or rule.startswith("\\#"):
+                rule = rule[1:]
+
+            if rule.startswith("re:"):
+                pattern = ".*?(?:{}).*".format(rule[3:])
+            else:
+                pattern = self._translate(rule)
+
+            group = "r{}".format(index)
+            self._includes[group] = include
+            alternatives.append("(?P<{}>{})".format(group, pattern))
+
+        self._regex = re.compile("|".join(alternatives), re.DOTALL)
+
+        return self
+
+    def excludes(self, path, isdir=False):
+        """Retourne vrai si le chemin relatif doit être exclu du parcours."""
+        if not self.rules:
+            return False
+
+        if self._regex is None:
+            self.compile()
+
+        if isdir:
+            path = path + "/"
+
+        results = self._regex.fullmatch(path)
+
+        if not results:
+            return False
+
+        return not self._includes[results.lastgroup]
+
+    def _translate(self, rule):
+        """Traduit un motif .gitignore en expression régulière."""
+        dirOnly = rule.endswith("/")
+        rule = rule.rstrip("/")
+
+        anchored = "/" in rule
+
+        rule = rule.lstrip("/")
+
+        pattern = ""
+        i = 0
+
+        while i < len(rule):
+            char = rule[i]
+
+            if rule.startswith("**/", i):
+                pattern = pattern + "(?:.*/)?"
+                i = i + 3
+                continue
+            elif rule.startswith("/**", i) and i + 3 == len(rule):
+                pattern = pattern + "/.*"
+                i = i + 3
+                continue
+            elif rule.startswith("**", i):
+                pattern = pattern + ".*"
+                i = i + 2
+                continue
+            elif char == "*":
+                pattern = pattern + "[^/]*"
+            elif char == "?":
+                pattern = pattern + "[^/]"
+            elif char == "[":
+                end = rule.find("]", i + 1)
+
+                if end == -1:
+                    pattern = pattern + re.escape(char)
+                else:
+                    chars = rule[i + 1:end]
+
+                    if chars.startswith("!"):
+                        chars = "^" + chars[1:]
+
+                    pattern = pattern + "[" + chars.replace("\\", "\\\\") + "]"
+                    i = end
+            elif char == "\\" and i + 1 < len(rule):
+                i = i + 1
+                pattern = pattern + re.escape(rule[i])
+            else:
+                pattern = pattern + re.escape(char)
+
+            i = i + 1
+
+        if not anchored:
+            pattern = "(?:.*/)?" + pattern
+
+        if dirOnly:
+            return pattern + "/"
+
+        return pattern + "/?"
@@ -0,0 +1,514 @@
+# -*- coding:utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from filesystem import FileSystem, FTP_PATH_PATTERN
+
+import ftplib
+import ftputil
+import ftputil_custom
+import os
+import posixpath
+import re
+import tempfile
+import threading
+
+# Taille des blocs lus ou envoyés sur une connexion de données
+BLOCK_SIZE = 1048576
+
+class FTPConnectionPool:
+    """Réserve de connexions FTPHost partagées entre plusieurs synchronisations.
+
+    Les connexions sont rangées par (serveur, port, utilisateur). Une
+    connexion libérée est réutilisée par la prochaine synchronisation visant
+    le même compte, ce qui évite une nouvelle connexion et authentification.
+
+    Seule la connexion principale de chaque FTPFileSystem passe par la
+    réserve. Les sessions dédiées aux transferts par segments, aux reprises
+    et aux suppressions parallèles (voir FTPFileSystem._openSession) sont
+    ouvertes en plus : une synchronisation peut ainsi utiliser jusqu'à
+    segments ou deleteWorkers connexions supplémentaires par dossier.
+    """
+
+    def __init__(self):
+        self._idle = dict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, server, port, user, password):
+        """Renvoie une connexion libre ou en ouvre une nouvelle."""
+        key = (server, port, user)
+
+        while True:
+            with self._lock:
+                if not self._idle.get(key):
+                    break
+
+                ftp = self._idle[key].pop()
+
+            # La connexion a pu être fermée par le serveur pendant son attente
+            try:
+                ftp._session.voidcmd("NOOP")
+            except Exception:
+                self._discard(ftp)
+                continue
+
+            with self._lock:
+                self.reused = self.reused + 1
+
+            return ftp
+
+        ftp = ftputil.FTPHost(
+            host=server, 
+            port=port, 
+            user=user, 
+            password=password, 
+            session_factory=ftputil_custom.FTPSession)
+
+        with self._lock:
+            self.created = self.created + 1
+
+        return ftp
+
+    def release(self, server, port, user, ftp):
+        """Remet une connexion à disposition."""
+        if ftp.closed:
+            return
+
+        with self._lock:
+            self._idle.setdefault((server, port, user), list()).append(ftp)
+
+    def close(self):
+        """Ferme toutes les connexions libres."""
+        with self._lock:
+            idle = [ftp for connections in self._idle.values()
+                for ftp in connections]
+            self._idle.clear()
+
+        for ftp in idle:
+            self._discard(ftp)
+
+    def _discard(self, ftp):
+        try:
+            ftp.close()
+        except Exception: pass
+
+# Réserve de connexions utilisée par FTPFileSystem lorsqu'elle est définie (mode
+# multi-tâches), sinon chaque système de fichiers ouvre sa propre connexion.
+connectionPool = None
+
+class FTPWorkerSession:
+    """Connexion FTP dédiée à une tâche parallèle (suppressions)."""
+
+    def __init__(self, session, basepath):
+        self.session = session
+        self.basepath = basepath
+
+    def delete(self, filename):
+        self.session.delete(posixpath.join(self.basepath, filename))
+
+    def rmdir(self, path):
+        self.session.rmd(posixpath.join(self.basepath, path))
+
+    def close(self):
+        try:
+            self.session.quit()
+        except Exception:
+            self.session.close()
+
+class FTPFileSystem(FileSystem):
+    supportedPathPatterns = [
+        re.compile(FTP_PATH_PATTERN, re.IGNORECASE)
+    ]
+
+    segmentedTransfers = True
+
+    # Les dates MLSD sont relevées à la seconde
+    mtimePrecision = 1
+
+    def __init__(self):
+        super().__init__()
+
+        self.ftp = None
+        self._stat_cache = None
+        self._features = None
+        
+    def keep_alive(self, *args, **kwargs):
+        try:
+            self.ftp.chdir(self.ftp.getcwd())
+        except ftputil.error.TemporaryError as e:
+            if "421" in str(e):
+                self.open_connection()
+        
+    def mkdir(self, path): pass
+
+    def makedirs(self, path): 
+        self.keep_alive()
+        
+        path = posixpath.join(self.basepath, path)
+        try:
+            self.ftp._session.mkd(path)
+        except: pass
+
+    def rmdir(self, path):
+        self.keep_alive()
+        
+        path = posixpath.join(self.basepath, path)
+        self.ftp.rmdir(path)
+
+    def rmtree(self, path):
+        self.keep_alive()
+        
+        path = posixpath.join(self.basepath, path)
+        self.ftp.rmtree(path, ignore_errors=True)
+
+    def open(self, path, mode, rest=None): 
+        self.keep_alive()
+        
+        path = posixpath.join(self.basepath, path)
+
+        return self.ftp.open(path, "rb", rest=rest or None)
+
+    def read(self, filename): pass
+
+    def write(self, filename, content=None, fd_content=None, keepPartial=False):
+        self.keep_alive()
+        filename = posixpath.join(self.basepath, filename)
+        
+        try:
+            fd = self.ftp.open(filename, "wb")
+
+            try:
+                self.ftp.copyfileobj(fd_content, fd, callback=self.keep_alive)
+            finally:
+                fd_content.close()
+                fd.close()
+        except Exception:
+            # Un envoi interrompu ne doit pas laisser un fichier tronqué plus
+            # récent que sa source, sauf s'il doit être repris
+            if not keepPartial:
+                try:
+                    self.ftp.unlink(filename)
+                except Exception: pass
+
+            raise
+                
+    def getsize(self, path):
+        self.keep_alive()
+        path = posixpath.join(self.basepath, path)
+
+        try:
+            self.ftp._session.voidcmd("TYPE I")
+
+            return self.ftp._session.size(path)
+        except ftplib.error_perm:
+            return None
+
+    def resume(self, filename, fd_content, offset):
+        """Reprend l'envoi d'un fichier avec REST puis STOR, ou APPE si le
+        serveur ne gère pas REST et que le fichier distant s'arrête à offset."""
+        if self.supportsRestart():
+            command, rest = "STOR", offset
+        elif self.getsize(filename) == offset:
+            command, rest = "APPE", None
+        else:
+            return False
+
+        filename = posixpath.join(self.basepath, filename)
+        session = self._openSession()
+
+        try:
+            session.storbinary(command + " " + filename, fd_content, BLOCK_SIZE, rest=rest)
+        finally:
+            session.close()
+            fd_content.close()
+
+        return True
+
+    def openSession(self):
+        """Ouvre une connexion dédiée à une tâche parallèle."""
+        return FTPWorkerSession(self._openSession(), self.basepath)
+
+    def supportsRestart(self):
+        """Retourne vrai si le serveur accepte REST avant RETR et STOR."""
+        if self._features is None:
+            self.keep_alive()
+
+            try:
+                self._features = self.ftp._session.sendcmd("FEAT").upper()
+            except ftplib.Error:
+                self._features = ""
+
+        return "REST STREAM" in self._features
+
+    def download(self, path, localFilename, size, segments=4):
+        """Télécharge un fichier par segments en parallèle.
+
+        Chaque segment est récupéré sur sa propre connexion à l'aide de REST
+        puis écrit à sa position dans un fichier temporaire préalloué du
+        dossier local. Ce fichier ne remplace le fichier local qu'une fois
+        tous les segments reçus en entier, et il est supprimé en cas
+        d'erreur. Renvoie faux si le serveur ne gère pas la reprise, le
+        fichier devant alors être copié en un seul flux.
+        """
+        if not self.supportsRestart():
+            return False
+
+        path = posixpath.join(self.basepath, path)
+
+        dirname, basename = os.path.split(localFilename)
+        handle, tmpFilename = tempfile.mkstemp(
+            prefix="." + basename + ".", suffix=".part", dir=dirname or None)
+
+        def downloadSegment(segment):
+            offset, length = segment
+            session = self._openSession()
+
+            try:
+                conn = session.transfercmd("RETR " + path, rest=offset)
+                received = 0
+
+                with conn, open(tmpFilename, "r+b") as fd:
+                    fd.seek(offset)
+
+                    while received < length:
+                        data = conn.recv(min(BLOCK_SIZE, length - received))
+
+                        if not data:
+                            break
+
+                        fd.write(data)
+                        received = received + len(data)
+            finally:
+                # Le transfert est interrompu avant la fin du fichier, la
+                # session n'est donc pas réutilisable
+                session.close()
+
+            if received != length:
+                raise IOError("{path} : segment {offset} incomplet ({received}/{length} octets).".format(
+                    path=path,
+                    offset=offset,
+                    received=received,
+                    length=length))
+
+            return received
+
+        try:
+            with os.fdopen(handle, "wb") as fd:
+                if size and hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(fd.fileno(), 0, size)
+                else:
+                    fd.truncate(size)
+
+            with ThreadPoolExecutor(max_workers=segments) as executor:
+                received = sum(executor.map(downloadSegment, self._segments(size, segments)))
+
+            if received != size:
+                raise IOError("{} : taille du fichier téléchargé incorrecte.".format(path))
+        except BaseException:
+            os.unlink(tmpFilename)
+
+            raise
+
+        os.replace(tmpFilename, localFilename)
+
+        return True
+
+    def upload(self, localFilename, path, size, segments=4):
+        """Envoie un fichier par segments en parallèle.
+
+        Le premier segment crée le fichier distant avec STOR, les suivants
+        sont envoyés sur leur propre connexion avec REST puis STOR. Les
+        serveurs qui refusent une position au-delà de la taille courante du
+        fichier (réponse 554) reçoivent les segments refusés dans l'ordre,
+        une fois les précédents terminés. Renvoie faux si le serveur ne gère
+        pas la reprise.
+        """
+        if not self.supportsRestart():
+            return False
+
+        path = posixpath.join(self.basepath, path)
+        created = threading.Event()
+        deferred = list()
+
+        def uploadSegment(segment):
+            offset, length = segment
+
+            # Seul le premier segment tronque le fichier distant, les autres
+            # attendent donc sa création
+            if offset > 0:
+                created.wait()
+
+            session = self._openSession()
+
+            try:
+                try:
+                    conn = session.transfercmd("STOR " + path,
+                        rest=offset if offset > 0 else None)
+                except ftplib.error_perm as e:
+                    if offset > 0 and str(e).startswith("554"):
+                        deferred.append(segment)
+                        return
+
+                    raise
+                finally:
+                    if offset == 0:
+                        created.set()
+
+                with conn, open(localFilename, "rb") as fd:
+                    fd.seek(offset)
+                    sent = 0
+
+                    while sent < length:
+                        data = fd.read(min(BLOCK_SIZE, length - sent))
+
+                        if not data:
+                            break
+
+                        conn.sendall(data)
+                        sent = sent + len(data)
+
+                session.voidresp()
+            finally:
+                session.close()
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            list(executor.map(uploadSegment, self._segments(size, segments)))
+
+        for segment in sorted(deferred):
+            uploadSegment(segment)
+
+        session = self._openSession()
+
+        try:
+            remoteSize = session.size(path)
+        finally:
+            session.close()
+
+        if remoteSize != size:
+            raise IOError("{} : taille du fichier envoyé incorrecte.".format(path))
+
+        return True
+
+    def _segments(self, size, segments):
+        """Découpe un fichier en une liste de tuples (position, longueur)."""
+        length = max(1, -(-size // max(1, segments)))
+
+        return [(offset, min(length, size - offset))
+            for offset in range(0, max(size, 1), length)]
+
+    def _openSession(self):
+        """Ouvre une session FTP dédiée à un segment de transfert, à une
+        reprise ou à une tâche de suppression.
+
+        La session est ouverte hors de la réserve de connexions et doit être
+        fermée par l'appelant.
+        """
+        session = ftputil_custom.FTPSession(
+            self.server, self.user, self.password, self.port)
+        session.voidcmd("TYPE I")
+
+        return session
+
+    def delete(self, filename): 
+        self.keep_alive()
+        
+        filename = posixpath.join(self.basepath, filename)
+        self.ftp.unlink(filename)
+
+    def utime(self, path, times):
+        self.keep_alive()
+        path = posixpath.join(self.basepath, path)
+
+        mtime = datetime.utcfromtimestamp(times[1]).strftime("%Y%m%d%H%M%S")
+        
+        self.ftp._session.sendcmd("MFMT {mtime} {path}".format(
+            mtime=mtime,
+            path=path))
+
+    def stat(self, path):
+        return self.ftp.lstat(path)
+
+    def isdir(self, path):
+        self.keep_alive()
+        path = posixpath.join(self.basepath, path)
+        return self.ftp.path.isdir(path)
+
+    def walk(self, path): 
+        return self.ftp.walk(path)
+
+    def listdir(self, path):
+        self.keep_alive()
+        path = posixpath.join(self.basepath, path)
+        entries = list()
+
+        for name in self.ftp.listdir(path):
+            child = posixpath.join(path, name)
+            entries.append((name, self.ftp.path.isdir(child), self.ftp.lstat(child).st_size))
+
+        return entries
+
+    def init(self, path):
+        """Initialise l'accès au système de fichiers."""
+        self.basepath = "/"
+
+        pattern, results = self.foundPathPattern(path)
+
+        self.user = "anonymous"
+        self.password = ""
+        self.port = 21
+
+        if results.group(2):
+            self.user = results.group(2)
+            self.password = results.group(3)
+
+        self.server = results.group(4)
+
+        if results.group(6):
+            self.port = int(results.group(6))
+
+        if results.group(7):
+            self.basepath = results.group(7)
+            
+        self.open_connection()
+            
+        return self
+    
+    def close(self):
+        """Libère la connexion ou la rend à la réserve de connexions."""
+        if connectionPool:
+            connectionPool.release(self.server, self.port, self.user, self.ftp)
+        else:
+            self.ftp.close()
+
+    def open_connection(self):
+        # Reconnexion après une déconnexion du serveur (421) : l'ancienne
+        # connexion est fermée plutôt que rendue à la réserve
+        if self.ftp is not None:
+            try:
+                self.ftp.close()
+            except Exception: pass
+
+        if connectionPool:
+            self.ftp = connectionPool.acquire(
+                self.server, self.port, self.user, self.password)
+        else:
+            self.ftp = ftputil.FTPHost(
+                host=self.server, 
+                port=self.port, 
+                user=self.user, 
+                password=self.password, 
+                session_factory=ftputil_custom.FTPSession)
+        
+        if self._stat_cache == None:
+            self._stat_cache = ftputil_custom._StatMLSD(self.ftp)
+        else:
+            _cache = self._stat_cache._lstat_cache
+            self._stat_cache = ftputil_custom._StatMLSD(self.ftp)
+            self._stat_cache._lstat_cache = _cache
+        
+        self.ftp._stat = self._stat_cache
+        self.ftp.chdir(self.basepath)
+
+        return self
@@ -1,11 +1,10 @@
 # -*- coding:utf-8 -*-
 
-from datetime import datetime
-
 import ftplib
 import ftputil
+import ftputil.lrucache
+import calendar
 import math
-import pytz
 import time
 
 class FTPSession(ftplib.FTP):
@@ -64,7 +63,7 @@ class _StatMLSD(ftputil.stat._Stat):
             # commande MLSD
             list_stat_result = list(stat_result)
             mtime = files[stat_result._st_name]["modify"]
-            mtimestamp = datetime.strptime(mtime, "%Y%m%d%H%M%S").timestamp()
+            mtimestamp = mlsdTimestamp(mtime)
             list_stat_result[8] = mtimestamp
 
             _stat_result = ftputil.stat.StatResult(list_stat_result)
@@ -87,6 +86,16 @@ class CustomStatCache(ftputil.stat_cache.StatCache):
         self._cache = DictCache()
 
 
+def mlsdTimestamp(mtime):
+    """Convertit une date MLSD (YYYYMMDDHHMMSS[.sss], toujours en UTC) en timestamp."""
+    mtime, _, fraction = mtime.partition(".")
+    timestamp = calendar.timegm(time.strptime(mtime, "%Y%m%d%H%M%S"))
+
+    if fraction:
+        timestamp = timestamp + float("0." + fraction)
+
+    return timestamp
+
 class DictCache():
     def __init__(self):
         self._cache = dict()
@@ -106,10 +115,12 @@ class DictCache():
         self._cache[key] = obj
 
     def __getitem__(self, key):
+        # Comme LRUCache, une entrée absente lève CacheKeyError afin que
+        # ftputil liste le dossier parent au lieu de renvoyer None
         try:
             return self._cache[key]
         except KeyError:
-            return
+            raise ftputil.lrucache.CacheKeyError(key)
 
     def __delitem__(self, key):
         self._cache.pop(key)
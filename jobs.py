@@ -0,0 +1,175 @@
+# -*- coding:utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+
+import json
+import logging
+import time
+
+def loadJobFile(filename):
+    """Charge un fichier de tâches au format JSON ou YAML.
+
+    Le fichier contient soit une liste de tâches, soit un dictionnaire avec
+    les clés suivantes :
+    - "jobs" : liste des tâches, chacune contenant au minimum les clés
+      "dirLeft" et "dirRight" ainsi que les options de SyncConfiguration ;
+    - "options" : options communes à toutes les tâches (facultatif) ;
+    - "concurrency" : nombre de synchronisations simultanées (facultatif).
+    """
+    with open(filename, "r", encoding="utf-8") as fd:
+        if filename.lower().endswith((".yml", ".yaml")):
+            import yaml
+
+            content = yaml.safe_load(fd)
+        else:
+            content = json.load(fd)
+
+    if isinstance(content, list):
+        content = {"jobs": content}
+
+    return content
+
+class SyncJob:
+    """Synchronisation d'une paire de dossiers au sein d'un fichier de tâches."""
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.summary = None
+        self.error = None
+        self.duration = 0
+
+class JobRunner:
+    """Exécute plusieurs synchronisations en parallèle.
+
+    Le nombre de synchronisations simultanées est limité par concurrency. Les
+    connexions FTP sont partagées entre les tâches par une réserve de
+    connexions indexée par (serveur, port, utilisateur).
+    """
+
+    def __init__(self, jobs, concurrency=4, options=None, log=None):
+        self.concurrency = max(1, concurrency)
+        self.jobs = list()
+
+        if not log:
+            log = logging.getLogger("null")
+            log.addHandler(logging.NullHandler())
+
+        self.log = log
+
+        for job in jobs:
+            job = dict(job)
+            name = job.pop("name", "{} -> {}".format(
+                job.get("dirLeft"), job.get("dirRight")))
+
+            jobOptions = dict(options or dict())
+            jobOptions.update(job)
+
+            self.jobs.append(SyncJob(name, jobOptions))
+
+    @classmethod
+    def fromFile(cls, filename, concurrency=None, options=None, log=None):
+        """Crée l'exécuteur à partir d'un fichier de tâches.
+
+        options (celles de la ligne de commande) sont remplacées par les
+        options communes du fichier, elles-mêmes remplacées par celles de
+        chaque tâche.
+        """
+        content = loadJobFile(filename)
+
+        jobOptions = dict(options or dict())
+        jobOptions.update(content.get("options", dict()))
+
+        if concurrency is None:
+            concurrency = content.get("concurrency", 4)
+
+        return cls(content["jobs"], concurrency, jobOptions, log)
+
+    def run(self):
+        """Exécute toutes les tâches puis renvoie la liste des tâches."""
+        usesFTP = any(str(job.options.get(key, "")).lower().startswith("ftp://")
+            for job in self.jobs for key in ("dirLeft", "dirRight"))
+
+        # La réserve n'est créée qu'en présence de dossiers FTP afin de ne pas
+        # charger ftputil pour des tâches uniquement locales
+        if usesFTP:
+            import ftpfilesystem
+
+            ftpfilesystem.connectionPool = ftpfilesystem.FTPConnectionPool()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(self._runJob, self.jobs))
+        finally:
+            if usesFTP:
+                pool = ftpfilesystem.connectionPool
+                ftpfilesystem.connectionPool = None
+                pool.close()
+
+                self.log.info("Connexions FTP : {created} ouverte(s), "
+                    "{reused} réutilisation(s).".format(
+                        created=pool.created,
+                        reused=pool.reused))
+
+        return self.jobs
+
+    def _runJob(self, job):
+        # Import local pour éviter une dépendance circulaire avec sync.py
+        from sync import Sync, SyncConfiguration
+
+        start = time.time()
+        sync = None
+
+        self.log.info("[{}] Démarrage...".format(job.name))
+
+        try:
+            sync = Sync(SyncConfiguration(**job.options), self.log)
+            sync.sync()
+            job.summary = sync.summary()
+        except Exception as e:
+            job.error = e
+            self.log.error("[{}] {}".format(job.name, e))
+        finally:
+            if sync:
+                sync.close()
+
+            job.duration = time.time() - start
+
+        return job
+
+    def report(self):
+        """Renvoie le rapport combiné de l'ensemble des tâches."""
+        lines = list()
+        totals = dict()
+        failures = 0
+
+        for job in self.jobs:
+            if job.error:
+                failures = failures + 1
+                lines.append("[ERREUR] {name} ({duration:.1f}s) : {error}".format(
+                    name=job.name,
+                    duration=job.duration,
+                    error=job.error))
+                continue
+
+            for key, value in job.summary.items():
+                totals[key] = totals.get(key, 0) + value
+
+            lines.append("[OK] {name} ({duration:.1f}s) : {filesCopied} "
+                "fichier(s) copié(s), {filesRemoved} supprimé(s), {dirsCreated} "
+                "dossier(s) créé(s), {dirsRemoved} supprimé(s).".format(
+                    name=job.name,
+                    duration=job.duration,
+                    **job.summary))
+
+        lines.append("{ok} tâche(s) réussie(s), {failures} en échec : {filesCopied} "
+            "fichier(s) copié(s), {filesRemoved} supprimé(s), {dirsCreated} "
+            "dossier(s) créé(s), {dirsRemoved} supprimé(s).".format(
+                ok=len(self.jobs) - failures,
+                failures=failures,
+                filesCopied=totals.get("filesCopied", 0),
+                filesRemoved=totals.get("filesRemoved", 0),
+                dirsCreated=totals.get("dirsCreated", 0),
+                dirsRemoved=totals.get("dirsRemoved", 0)))
+
+        return "\n".join(lines)
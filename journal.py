@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+
+import json
+import os
+import os.path
+import threading
+
+# Nombre d'octets transférés entre deux enregistrements de progression
+PROGRESS_INTERVAL = 8388608
+
+# Nombre d'octets comparés avant la position de reprise d'un transfert
+VERIFY_SIZE = 65536
+
+class SyncJournal:
+    """Journal des opérations effectuées pendant une synchronisation.
+
+    Le journal est un fichier JSON lines. La première ligne identifie la
+    synchronisation (dossiers et mode), les suivantes enregistrent les
+    opérations terminées ("done") ou la position atteinte dans un transfert
+    en cours ("offset"). Une synchronisation relancée après une erreur
+    ignore les opérations terminées et reprend les transferts interrompus.
+    Le journal est supprimé lorsque la synchronisation se termine sans
+    erreur.
+
+    Chaque opération enregistre la taille et la date de modification de
+    l'élément concerné ("source"), relevées lors du parcours. Une opération
+    n'est reprise ou ignorée que si l'élément n'a pas été modifié depuis :
+    un fichier modifié après l'erreur est copié à nouveau en entier.
+    """
+
+    def __init__(self, filename, header):
+        self.filename = filename
+        self.header = header
+        self._entries = dict()
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Charge le journal existant puis l'ouvre en écriture."""
+        self._entries = dict()
+
+        if os.path.exists(self.filename):
+            self._load()
+
+        if self._entries:
+            self._fd = open(self.filename, "a", encoding="utf-8")
+        else:
+            self._fd = open(self.filename, "w", encoding="utf-8")
+            self._write(self.header)
+
+        return self
+
+    def close(self, completed=False):
+        """Ferme le journal, et le supprime si la synchronisation est terminée."""
+        if self._fd:
+            self._fd.close()
+            self._fd = None
+
+        if completed and os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    def isDone(self, action, side, path, stat=None):
+        """Retourne vrai si l'opération a été terminée lors d'une exécution
+        précédente sur l'élément de même taille et même date stat."""
+        return self.state(action, side, path, stat) == "done"
+
+    def offset(self, action, side, path, stat=None):
+        """Position atteinte dans un transfert interrompu (0 par défaut)."""
+        state = self.state(action, side, path, stat)
+
+        if isinstance(state, int):
+            return state
+
+        return 0
+
+    def pending(self, action):
+        """Liste des tuples (côté, chemin) des opérations commencées mais non terminées."""
+        return [(side, path)
+            for (_action, side, path), (state, source) in self._entries.items()
+            if _action == action and state != "done"]
+
+    def start(self, action, side, path, stat=None):
+        self.progress(action, side, path, 0, stat)
+
+    def progress(self, action, side, path, offset, stat=None):
+        source = self._source(stat)
+        self._entries[(action, side, path)] = (offset, source)
+        self._write({"action": action, "side": side, "path": path, "offset": offset,
+            "source": source})
+
+    def done(self, action, side, path, stat=None):
+        source = self._source(stat)
+        self._entries[(action, side, path)] = ("done", source)
+        self._write({"action": action, "side": side, "path": path, "done": True,
+            "source": source})
+
+    def reader(self, fd, action, side, path, offset=0, stat=None):
+        """Enveloppe un fichier source pour enregistrer la progression de sa lecture."""
+        return JournalReader(fd, self, action, side, path, offset, stat)
+
+    def state(self, action, side, path, stat=None):
+        """État enregistré d'une opération ("done" ou position atteinte), ou
+        None si elle est absente du journal ou si l'élément a changé."""
+        state, source = self._entries.get((action, side, path), (None, None))
+
+        if source != self._source(stat):
+            return None
+
+        return state
+
+    def _source(self, stat):
+        if stat is None:
+            return None
+
+        return [stat["size"], stat["mdate"]]
+
+    def _write(self, entry):
+        with self._lock:
+            self._fd.write(json.dumps(entry) + "\n")
+            self._fd.flush()
+
+    def _load(self):
+        with open(self.filename, "r", encoding="utf-8") as fd:
+            lines = fd.readlines()
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return
+
+        # Journal d'une autre synchronisation
+        if header != self.header:
+            return
+
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Dernière ligne tronquée par l'interruption
+                continue
+
+            key = (entry["action"], entry["side"], entry["path"])
+
+            if entry.get("done"):
+                self._entries[key] = ("done", entry.get("source"))
+            else:
+                self._entries[key] = (entry["offset"], entry.get("source"))
+
+class JournalReader:
+    """Fichier source dont la progression de lecture est enregistrée dans le journal."""
+
+    def __init__(self, fd, journal, action, side, path, offset=0, stat=None):
+        self._fd = fd
+        self._journal = journal
+        self._key = (action, side, path)
+        self._offset = offset
+        self._recorded = offset
+        self._stat = stat
+
+    def read(self, size=-1):
+        data = self._fd.read(size)
+        self._advance(len(data))
+
+        return data
+
+    def readinto(self, buffer):
+        if not hasattr(self._fd, "readinto"):
+            data = self.read(len(buffer))
+            buffer[:len(data)] = data
+
+            return len(data)
+
+        length = self._fd.readinto(buffer)
+        self._advance(length)
+
+        return length
+
+    def close(self):
+        self._fd.close()
+
+    def _advance(self, length):
+        self._offset = self._offset + length
+
+        if self._offset - self._recorded >= PROGRESS_INTERVAL:
+            self._journal.progress(*self._key, self._offset, self._stat)
+            self._recorded = self._offset
@@ -0,0 +1,151 @@
+# -*- coding:utf-8 -*-
+
+import gzip
+import hashlib
+import io
+import json
+import posixpath
+import random
+
+# Nom du manifeste, à la racine du dossier distant
+MANIFEST_NAME = ".sync-manifest.json.gz"
+
+# Nombre de dossiers dont le listing est comparé au manifeste
+SAMPLE_SIZE = 8
+
+class Manifest:
+    """État d'un dossier distant enregistré sur le serveur lui-même.
+
+    Le manifeste contient, pour chaque fichier, sa taille, sa date de
+    modification et éventuellement son empreinte SHA-1, ainsi que la liste
+    des dossiers. Il est envoyé à la racine du dossier après chaque
+    synchronisation réussie et remplace le parcours complet du dossier à
+    l'exécution suivante. Il n'est fiable que si le dossier n'est modifié
+    que par cet outil : quelques dossiers tirés au hasard sont donc listés
+    et comparés au manifeste avant de l'utiliser.
+    """
+
+    def __init__(self, files=None, dirs=None, hashes=None, rules=None):
+        self.files = files or dict()
+        self.dirs = dirs or dict()
+        self.hashes = hashes or dict()
+        self.rules = list(rules or list())
+
+    @classmethod
+    def load(cls, fs, rules=None):
+        """Télécharge le manifeste du dossier, None s'il est absent ou illisible."""
+        try:
+            fd = fs.open(MANIFEST_NAME, "rb")
+
+            try:
+                content = json.loads(gzip.decompress(fd.read()).decode("utf-8"))
+            finally:
+                fd.close()
+        except Exception:
+            return None
+
+        if content.get("rules") != list(rules or list()):
+            return None
+
+        files = dict()
+        hashes = dict()
+
+        for path, entry in content["files"].items():
+            files[path] = {"size": entry[0], "mdate": entry[1]}
+
+            if len(entry) > 2:
+                hashes[path] = entry[2]
+
+        dirs = {path: {"size": size, "mdate": mdate}
+            for path, (size, mdate) in content["dirs"].items()}
+
+        return cls(files, dirs, hashes, content["rules"])
+
+    def save(self, fs):
+        """Envoie le manifeste à la racine du dossier."""
+        content = {
+            "rules": self.rules,
+            "files": {path: [stat["size"], stat["mdate"]] +
+                ([self.hashes[path]] if path in self.hashes else list())
+                for path, stat in self.files.items()},
+            "dirs": {path: [stat["size"], stat["mdate"]]
+                for path, stat in self.dirs.items()}
+        }
+
+        data = gzip.compress(json.dumps(content).encode("utf-8"))
+        fs.write(MANIFEST_NAME, fd_content=io.BytesIO(data))
+
+    @staticmethod
+    def discard(fs):
+        """Supprime le manifeste du dossier avant sa modification.
+
+        Une synchronisation interrompue ne laisse ainsi pas un manifeste
+        périmé, qui serait repris au lieu du parcours à l'exécution suivante.
+        """
+        try:
+            fs.delete(MANIFEST_NAME)
+        except Exception:
+            # Manifeste absent
+            pass
+
+    def spotCheck(self, fs, pathFilter=None, sample=SAMPLE_SIZE):
+        """Compare le listing de quelques dossiers au manifeste.
+
+        La racine est toujours vérifiée. Les noms et les tailles sont
+        comparés, les dates de modification relevées sur le serveur pouvant
+        différer de celles enregistrées.
+        """
+        children = {"": set()}
+
+        for path in self.dirs:
+            children.setdefault(path, set())
+            children.setdefault(posixpath.dirname(path), set()).add((posixpath.basename(path), None))
+
+        for path, stat in self.files.items():
+            children.setdefault(posixpath.dirname(path), set()).add(
+                (posixpath.basename(path), stat["size"]))
+
+        paths = [path for path in children if path]
+        paths = [""] + random.sample(paths, min(sample, len(paths)))
+
+        for path in paths:
+            listing = set()
+
+            try:
+                entries = fs.listdir(path)
+            except Exception:
+                return False
+
+            for name, isdir, size in entries:
+                relpath = posixpath.join(path, name)
+
+                if not path and name == MANIFEST_NAME:
+                    continue
+
+                if pathFilter and pathFilter.excludes(relpath, isdir=isdir):
+                    continue
+
+                listing.add((name, None if isdir else size))
+
+            if listing != children[path]:
+                return False
+
+        return True
+
+def fileHash(fs, path):
+    """Empreinte SHA-1 du contenu d'un fichier."""
+    digest = hashlib.sha1()
+    fd = fs.open(path, "rb")
+
+    try:
+        while True:
+            data = fd.read(1048576)
+
+            if not data:
+                break
+
+            digest.update(data)
+    finally:
+        fd.close()
+
+    return digest.hexdigest()
@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+
+import posixpath
+import unicodedata
+
+class PathIndex:
+    """Index des chemins d'un dossier par chemin normalisé.
+
+    Un même nom peut être encodé différemment selon le client qui a créé le
+    fichier (NFD sous macOS, NFC ailleurs) ou ne différer que par la casse
+    sur un système de fichiers qui l'ignore (Windows). Les chemins des deux
+    dossiers sont donc comparés après normalisation Unicode (form, "NFC" ou
+    "NFD", None pour la désactiver) et éventuellement passage en minuscules
+    (caseFold). L'index associe chaque chemin normalisé au chemin réel du
+    dossier, afin d'appliquer les opérations sous le nom existant.
+
+    Si plusieurs chemins réels d'un même dossier ont le même chemin
+    normalisé, seul le premier dans l'ordre alphabétique est indexé et ces
+    chemins sont comparés sans normalisation. Les chemins normalisés en
+    collision d'un côté doivent être exclus des deux index (voir exclude),
+    faute de quoi un chemin comparé tel quel d'un côté serait associé au
+    chemin normalisé de l'autre.
+    """
+
+    def __init__(self, form="NFC", caseFold=False):
+        self.form = form
+        self.caseFold = caseFold
+        self.enabled = bool(form or caseFold)
+        self.collisions = set()
+        self.excluded = set()
+        self._paths = dict()
+        self._real = set()
+
+    def build(self, paths):
+        """Construit l'index à partir des chemins réels du dossier."""
+        self.collisions = set()
+        self._paths = dict()
+        self._real = set()
+
+        if not self.enabled:
+            return self
+
+        for path in sorted(paths):
+            self.add(path)
+
+        return self
+
+    def normalize(self, path):
+        if self.form:
+            path = unicodedata.normalize(self.form, path)
+
+        if self.caseFold:
+            path = path.casefold()
+
+        return path
+
+    def add(self, path):
+        if not self.enabled or path in self._real:
+            return
+
+        key = self.normalize(path)
+        self._real.add(path)
+
+        if key in self._paths:
+            self.collisions.add(key)
+        else:
+            self._paths[key] = path
+
+    def discard(self, path):
+        if not self.enabled or path not in self._real:
+            return
+
+        key = self.normalize(path)
+        self._real.discard(path)
+
+        if self._paths.get(key) == path:
+            del self._paths[key]
+
+    def exclude(self, keys):
+        """Compare sans normalisation les chemins dont le chemin normalisé
+        fait partie de keys (collisions de l'un ou l'autre dossier)."""
+        self.excluded = set(keys)
+
+        return self
+
+    def key(self, path):
+        """Clé de comparaison d'un chemin réel du dossier."""
+        if not self.enabled:
+            return path
+
+        key = self.normalize(path)
+
+        if key in self.collisions or key in self.excluded:
+            return path
+
+        return key
+
+    def resolve(self, path):
+        """Chemin réel dans ce dossier d'un chemin de l'autre dossier.
+
+        Un chemin absent du dossier est résolu à partir de son dossier
+        parent, le nom de l'entrée étant conservé.
+        """
+        if not self.enabled or path in self._real:
+            return path
+
+        key = self.normalize(path)
+        real = self._paths.get(key)
+
+        if real is not None and key not in self.collisions and key not in self.excluded:
+            return real
+
+        parent, name = posixpath.split(path)
+
+        if not parent:
+            return path
+
+        return posixpath.join(self.resolve(parent), name)
@@ -0,0 +1,89 @@
+# -*- coding:utf-8 -*-
+
+import queue
+import threading
+
+# Taille de chacun des tampons de la copie
+BUFFER_SIZE = 1048576
+
+# Nombre de tampons : la mémoire utilisée par une copie est bornée à
+# BUFFER_SIZE * BUFFER_COUNT octets
+BUFFER_COUNT = 4
+
+def copyStream(source, target, bufferSize=BUFFER_SIZE, buffers=BUFFER_COUNT):
+    """Copie le contenu du fichier source dans le fichier target.
+
+    La lecture est effectuée par un thread dédié dans un anneau de tampons
+    réutilisés, pendant que le thread appelant écrit les tampons déjà
+    remplis : la réception depuis le réseau et l'écriture sur le disque se
+    recouvrent. Les données sont lues avec readinto lorsque la source le
+    permet, sinon avec read puis recopiées dans le tampon.
+
+    Renvoie le nombre d'octets copiés. Une erreur de lecture est levée dans
+    le thread appelant.
+    """
+    free = queue.Queue()
+    filled = queue.Queue()
+    errors = list()
+    stop = threading.Event()
+
+    for i in range(max(2, buffers)):
+        free.put(bytearray(bufferSize))
+
+    readinto = getattr(source, "readinto", None)
+
+    if readinto is None:
+        def readinto(buffer):
+            data = source.read(len(buffer))
+            buffer[:len(data)] = data
+
+            return len(data)
+
+    def reader():
+        try:
+            while not stop.is_set():
+                buffer = free.get()
+
+                if buffer is None:
+                    break
+
+                length = readinto(buffer)
+
+                if not length:
+                    break
+
+                filled.put((buffer, length))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # Fin des données pour le thread d'écriture
+            filled.put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    copied = 0
+
+    try:
+        while True:
+            item = filled.get()
+
+            if item is None:
+                break
+
+            buffer, length = item
+
+            target.write(memoryview(buffer)[:length])
+
+            copied = copied + length
+            free.put(buffer)
+    finally:
+        # Débloque le thread de lecture si l'écriture a échoué
+        stop.set()
+        free.put(None)
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return copied
@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*-
+
+from contextlib import contextmanager
+
+import cProfile
+import functools
+import inspect
+import threading
+import time
+
+class Profiler:
+    """Mesure du temps passé dans les phases d'une synchronisation et dans
+    les appels aux systèmes de fichiers.
+
+    Chaque région mesurée (phase ou méthode instrumentée) enregistre son
+    nombre d'appels, son temps cumulé et son temps propre, c'est-à-dire hors
+    des régions imbriquées. Les régions sont imbriquées par thread : les
+    appels effectués par les threads de suppression ou de transfert forment
+    leurs propres piles. Le temps propre de chaque pile est conservé pour
+    produire un fichier au format "collapsed stacks" lisible par les outils
+    de flamegraph (flamegraph.pl, speedscope...).
+
+    Si useCProfile est vrai, le thread ayant créé le profileur est également
+    profilé par cProfile, ce qui détaille les appels internes (analyse des
+    listings MLSD, conversions de dates, ftputil...).
+    """
+
+    def __init__(self, useCProfile=False):
+        self.stats = dict()
+        self.stacks = dict()
+        self.cProfile = None
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        if useCProfile:
+            self.cProfile = cProfile.Profile()
+            self.cProfile.enable()
+
+    @contextmanager
+    def region(self, name):
+        """Mesure le bloc de code sous le nom name."""
+        stack = getattr(self._local, "stack", None)
+
+        if stack is None:
+            stack = self._local.stack = list()
+
+        # Chaque niveau de la pile contient le nom de la région et le temps
+        # passé dans ses régions imbriquées
+        frame = [name, 0]
+        stack.append(frame)
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            own = elapsed - frame[1]
+            path = ";".join(_frame[0] for _frame in stack)
+            stack.pop()
+
+            if stack:
+                stack[-1][1] = stack[-1][1] + elapsed
+
+            with self._lock:
+                count, total, _own = self.stats.get(name, (0, 0, 0))
+                self.stats[name] = (count + 1, total + elapsed, _own + own)
+                self.stacks[path] = self.stacks.get(path, 0) + own
+
+    def instrument(self, obj, label, names=None):
+        """Mesure les appels aux méthodes publiques de obj.
+
+        Les méthodes sont remplacées sur l'instance par des enveloppes, ce qui
+        mesure aussi les appels que l'objet effectue sur lui-même
+        (keep_alive...). Les régions sont nommées "label.méthode".
+        """
+        if names is None:
+            names = [name for name, member in inspect.getmembers(type(obj))
+                if not name.startswith("_") and inspect.isfunction(member)]
+
+        for name in names:
+            setattr(obj, name, self._wrap(getattr(obj, name), "{}.{}".format(label, name)))
+
+        return obj
+
+    def stop(self):
+        """Arrête le profilage par cProfile."""
+        if self.cProfile:
+            self.cProfile.disable()
+
+    def report(self, limit=30):
+        """Tableau des régions triées par temps propre décroissant."""
+        lines = ["{:>8}  {:>10}  {:>10}  {}".format(
+            "Appels", "Cumulé (s)", "Propre (s)", "Région")]
+
+        stats = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)
+
+        for name, (count, total, own) in stats[:limit]:
+            lines.append("{:>8}  {:>10.3f}  {:>10.3f}  {}".format(count, total, own, name))
+
+        return "\n".join(lines)
+
+    def writeStacks(self, filename):
+        """Enregistre le temps propre de chaque pile, en microsecondes."""
+        with open(filename, "w", encoding="utf-8") as fd:
+            for path, own in sorted(self.stacks.items()):
+                fd.write("{} {}\n".format(path, int(own * 1000000)))
+
+    def dump(self, filename):
+        """Enregistre les statistiques cProfile (lisibles par pstats)."""
+        if self.cProfile:
+            self.cProfile.dump_stats(filename)
+
+    def _wrap(self, method, name):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with self.region(name):
+                result = method(*args, **kwargs)
+
+            # Le parcours d'un générateur (walk) est mesuré à chaque élément
+            if inspect.isgenerator(result):
+                return self._iterate(result, name)
+
+            return result
+
+        return wrapper
+
+    def _iterate(self, generator, name):
+        while True:
+            with self.region(name):
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+
+            yield item
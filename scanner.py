@@ -0,0 +1,138 @@
+# -*- coding:utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+
+import os
+import posixpath
+
+# Nombre de sous-arborescences confiées à chaque processus : le découpage en
+# plus de parts que de processus équilibre les arborescences déséquilibrées
+SUBTREES_PER_WORKER = 8
+
+# Nombre maximal de niveaux parcourus par le processus principal pour
+# découper l'arborescence
+MAX_SPLIT_DEPTH = 4
+
+class LocalScanner:
+    """Parcours d'un dossier local réparti sur plusieurs processus.
+
+    Le processus principal parcourt les premiers niveaux de l'arborescence
+    jusqu'à obtenir suffisamment de sous-dossiers, puis chaque sous-dossier
+    est parcouru entièrement par un processus du pool. Chaque processus
+    renvoie la liste compacte des dossiers et fichiers de sa
+    sous-arborescence, sous forme de tuples (chemin relatif, taille, date de
+    modification), que le processus principal fusionne.
+
+    Comme os.walk, les liens symboliques vers des dossiers sont listés comme
+    des dossiers mais ne sont pas parcourus, et les dossiers illisibles sont
+    ignorés.
+    """
+
+    def __init__(self, basepath, pathFilter=None, workers=2):
+        self.basepath = basepath
+        self.pathFilter = pathFilter
+        self.workers = max(1, workers)
+
+    def scan(self):
+        """Renvoie un tuple (dossiers, fichiers) de dictionnaires dont la clé
+        est le chemin relatif et la valeur un dictionnaire (size, mdate)."""
+        dirs = dict()
+        files = dict()
+
+        subtrees = self._split(dirs, files)
+
+        if subtrees:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = executor.map(scanSubtree,
+                    [self.basepath] * len(subtrees), subtrees,
+                    [self.pathFilter] * len(subtrees))
+
+                for subdirs, subfiles in results:
+                    for path, size, mdate in subdirs:
+                        dirs[path] = {"size": size, "mdate": mdate}
+
+                    for path, size, mdate in subfiles:
+                        files[path] = {"size": size, "mdate": mdate}
+
+        return dirs, files
+
+    def _split(self, dirs, files):
+        """Parcourt les premiers niveaux dans le processus principal.
+
+        Renvoie la liste des sous-dossiers restant à parcourir.
+        """
+        pending = [""]
+        depth = 0
+
+        while pending and depth < MAX_SPLIT_DEPTH and \
+                len(pending) < self.workers * SUBTREES_PER_WORKER:
+            level = list()
+
+            for relroot in pending:
+                subdirs, subfiles, recurse = listEntries(self.basepath, relroot, self.pathFilter)
+
+                for path, size, mdate in subdirs:
+                    dirs[path] = {"size": size, "mdate": mdate}
+
+                for path, size, mdate in subfiles:
+                    files[path] = {"size": size, "mdate": mdate}
+
+                level.extend(recurse)
+
+            pending = level
+            depth = depth + 1
+
+        return pending
+
+def listEntries(basepath, relroot, pathFilter=None):
+    """Contenu direct d'un dossier relatif.
+
+    Renvoie un tuple (dossiers, fichiers, dossiers à parcourir), les deux
+    premiers étant des listes de tuples (chemin relatif, taille, date de
+    modification).
+    """
+    dirs = list()
+    files = list()
+    recurse = list()
+
+    try:
+        entries = os.scandir(os.path.join(basepath, relroot) if relroot else basepath)
+    except OSError:
+        return dirs, files, recurse
+
+    with entries:
+        for entry in entries:
+            path = posixpath.join(relroot, entry.name)
+
+            try:
+                isdir = entry.is_dir()
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if pathFilter and pathFilter.excludes(path, isdir=isdir):
+                continue
+
+            if isdir:
+                dirs.append((path, stat.st_size, stat.st_mtime))
+
+                if not entry.is_symlink():
+                    recurse.append(path)
+            else:
+                files.append((path, stat.st_size, stat.st_mtime))
+
+    return dirs, files, recurse
+
+def scanSubtree(basepath, relroot, pathFilter=None):
+    """Parcourt entièrement un sous-dossier (exécuté dans un processus du pool)."""
+    dirs = list()
+    files = list()
+    stack = [relroot]
+
+    while stack:
+        subdirs, subfiles, recurse = listEntries(basepath, stack.pop(), pathFilter)
+        dirs.extend(subdirs)
+        files.extend(subfiles)
+        stack.extend(recurse)
+
+    return dirs, files
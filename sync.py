@@ -1,37 +1,83 @@
 # -*- coding:utf-8 -*-
-from datetime import datetime
-
 import argparse
+import compare
 import filesystem
+import filters
+import journal
 import logging
+import os
 import os.path
+import pathindex
 import posixpath
-import pytz
+import sys
+
+# Les modules des fonctionnalités optionnelles (parcours parallèle, cache des
+# parcours, manifeste, profilage...) sont importés là où ils sont utilisés,
+# afin de ne pas allonger le démarrage
 
 class Sync:
     """Classe permettant de synchroniser deux répertoires"""
 
     def __init__(self, config, log=None):
+        self.config = config
+        self.pathFilter = config.buildPathFilter()
+        self.digestCache = None
+        self.profiler = None
+
+        if config.profile:
+            import profiling
+
+            self.profiler = profiling.Profiler(config.profileCProfile)
+            self.profiler.instrument(self, "sync", ["updateSyncInfos",
+                "_doRemoveFiles", "_doRemoveDirs", "_doCopyDirs", "_doCopyFiles",
+                "_copyFile", "_applyResults", "_saveDigests", "_saveManifest"])
+
+        # Le manifeste n'est jamais synchronisé
+        if config.manifest:
+            import manifest
+
+            self.pathFilter.addRule("/" + manifest.MANIFEST_NAME)
+
+        if config.digestFile:
+            import digests
+
+            self.digestCache = digests.DigestCache(
+                config.digestFile, self.pathFilter.rules).load()
+
         self.setDirLeft(config.dirLeft)
         self.setDirRight(config.dirRight)
-        self.config = config
 
         if not log:
             log = logging.getLogger("null")
             log.addHandler(logging.NullHandler())
 
         self.log = log
+        self.journal = None
+        self.comparator = None
+        self._deletionEngines = dict()
 
         self.__syncInfosUpdated = False
 
     def setDirLeft(self, path):
-        self.dirLeft = SyncDirectory(path)
+        # Le cache des parcours n'est utilisé que pour le dossier de droite,
+        # supposé modifié uniquement par cet outil
+        self.dirLeft = SyncDirectory(path, self.pathFilter, None,
+            scanWorkers=self.config.scanWorkers, pathIndex=self._buildPathIndex())
+
+        if self.profiler:
+            self._profileDirectory(self.dirLeft, "left")
+
         self.__syncInfosUpdated = False
         
         return self
 
     def setDirRight(self, path):
-        self.dirRight = SyncDirectory(path)
+        self.dirRight = SyncDirectory(path, self.pathFilter, self.digestCache,
+            self.config.manifest, self.config.scanWorkers, self._buildPathIndex())
+
+        if self.profiler:
+            self._profileDirectory(self.dirRight, "right")
+
         self.__syncInfosUpdated = False
 
         return self
@@ -47,60 +93,215 @@ class Sync:
         else:
             self._buildFilesListsForSync()
 
-        # Suppression des fichiers
-        filesSide1, filesSide2 = self.filesToRemove.values()
-        if (len(filesSide1) + len(filesSide2)) > 0 :
-            self.log.info("Suppression des fichiers...")
+        self.journal = self._openJournal()
+
+        if self.journal:
+            self._applyJournal()
+
+        if self.digestCache and self._changesRight():
+            self._discardDigests()
 
-        self._doRemoveFiles()
+        if self.config.manifest and self._changesRight():
+            self._discardManifest()
 
-        # Suppression des dossiers        
-        filesSide1, filesSide2 = self.dirsToRemove.values()
-        if (len(filesSide1) + len(filesSide2)) > 0 :
-            self.log.info("Suppression des dossiers...")
+        try:
+            # Suppression des fichiers
+            filesSide1, filesSide2 = self.filesToRemove.values()
+            if (len(filesSide1) + len(filesSide2)) > 0 :
+                self.log.info("Suppression des fichiers...")
+
+            self._doRemoveFiles()
+
+            # Suppression des dossiers        
+            filesSide1, filesSide2 = self.dirsToRemove.values()
+            if (len(filesSide1) + len(filesSide2)) > 0 :
+                self.log.info("Suppression des dossiers...")
             
-        self._doRemoveDirs()
+            self._doRemoveDirs()
+            self._closeDeletionEngines()
 
-        # Création des dossiers
-        filesSide1, filesSide2 = self.dirsToCopy.values()
-        if (len(filesSide1) + len(filesSide2)) > 0 :
-            self.log.info("Création des dossiers...")
+            # Création des dossiers
+            filesSide1, filesSide2 = self.dirsToCopy.values()
+            if (len(filesSide1) + len(filesSide2)) > 0 :
+                self.log.info("Création des dossiers...")
             
-        self._doCopyDirs()
+            self._doCopyDirs()
 
-        # Copie des fichiers
-        filesSide1, filesSide2 = self.filesToCopy.values()
-        if (len(filesSide1) + len(filesSide2)) > 0 :
-            self.log.info("Copie des fichiers...")
+            # Copie des fichiers
+            filesSide1, filesSide2 = self.filesToCopy.values()
+            if (len(filesSide1) + len(filesSide2)) > 0 :
+                self.log.info("Copie des fichiers...")
             
-        self._doCopyFiles()
+            self._doCopyFiles()
+        except Exception:
+            if self.journal:
+                self.journal.close()
+
+            raise
+        finally:
+            self._closeDeletionEngines()
+
+        if self.journal:
+            self.journal.close(completed=True)
+
+        if self.digestCache or self.config.manifest:
+            self._applyResults()
+
+        if self.digestCache:
+            self._saveDigests()
+
+        if self.config.manifest:
+            self._saveManifest()
+
+        if self.profiler:
+            self._reportProfile()
 
         return self
 
+    def close(self):
+        """Ferme l'accès aux systèmes de fichiers des deux dossiers."""
+        self.dirLeft.close()
+        self.dirRight.close()
+
+    def summary(self):
+        """Renvoie le nombre d'éléments traités par type d'opération."""
+        return {
+            "filesCopied": sum(len(paths) for paths in self.filesToCopy.values()),
+            "filesRemoved": sum(len(paths) for paths in self.filesToRemove.values()),
+            "dirsCreated": sum(len(paths) for paths in self.dirsToCopy.values()),
+            "dirsRemoved": sum(len(paths) for paths in self.dirsToRemove.values()),
+            "transfersAvoided": self.comparator.avoided if self.comparator else 0
+        }
+
     def updateSyncInfos(self):
-        """Mise à jour des infos de synchronisation."""
-        self.dirsOnlyLeftSide = self.dirLeft.dirs.keys() - self.dirRight.dirs.keys()
-        self.dirsOnlyRightSide = self.dirRight.dirs.keys() - self.dirLeft.dirs.keys()
+        """Mise à jour des infos de synchronisation.
+
+        Les deux arborescences sont comparées à partir de la racine en ne
+        descendant que dans les dossiers dont les empreintes agrégées
+        diffèrent. Les dates de modification sont comparées par
+        compare.MtimeComparator, à la précision des systèmes de fichiers, et
+        les chemins par leurs clés normalisées : les fichiers communs sont
+        des couples (chemin à gauche, chemin à droite).
+        """
+        self.comparator = self._buildComparator()
+        self.dirLeft.setMtimeKey(self.comparator.key("left"))
+        self.dirRight.setMtimeKey(self.comparator.key("right"))
+
+        self.dirsOnlyLeftSide = set()
+        self.dirsOnlyRightSide = set()
+
+        self.filesOnlyLeftSide = set()
+        self.filesOnlyRightSide = set()
+
+        commonFiles = set()
+
+        # Les noms en collision après normalisation d'un côté sont comparés
+        # tels quels des deux côtés
+        collisions = self.dirLeft.index.collisions | self.dirRight.index.collisions
+        self.dirLeft.index.exclude(collisions)
+        self.dirRight.index.exclude(collisions)
+
+        leftDigests, leftTree = self.dirLeft.digests, self.dirLeft.tree
+        rightDigests, rightTree = self.dirRight.digests, self.dirRight.tree
 
-        self.filesOnlyLeftSide = self.dirLeft.files.keys() - self.dirRight.files.keys()
-        self.filesOnlyRightSide = self.dirRight.files.keys() - self.dirLeft.files.keys()
+        stack = [("", "")]
 
-        self.filesMoreRecentLeftSide = self._updateMoreRecentFiles(self.dirLeft.files, self.dirRight.files)
-        self.filesMoreRecentRightSide = self._updateMoreRecentFiles(self.dirRight.files, self.dirLeft.files)
+        while stack:
+            leftPath, rightPath = stack.pop()
+
+            if leftDigests[leftPath] == rightDigests[rightPath]:
+                continue
+
+            leftDirs, leftFiles = leftTree[leftPath]
+            rightDirs, rightFiles = rightTree[rightPath]
+
+            leftFiles = {self.dirLeft.key(_file): _file for _file in leftFiles}
+            rightFiles = {self.dirRight.key(_file): _file for _file in rightFiles}
+
+            for key in leftFiles.keys() & rightFiles.keys():
+                commonFiles.add((leftFiles[key], rightFiles[key]))
+
+            for key in leftFiles.keys() - rightFiles.keys():
+                self.filesOnlyLeftSide.add(leftFiles[key])
+
+            for key in rightFiles.keys() - leftFiles.keys():
+                self.filesOnlyRightSide.add(rightFiles[key])
+
+            leftDirs = {self.dirLeft.key(_dir): _dir for _dir in leftDirs}
+            rightDirs = {self.dirRight.key(_dir): _dir for _dir in rightDirs}
+
+            for key in leftDirs.keys() & rightDirs.keys():
+                stack.append((leftDirs[key], rightDirs[key]))
+
+            for key in leftDirs.keys() - rightDirs.keys():
+                self._addSubtree(leftDirs[key], leftTree, self.dirsOnlyLeftSide, self.filesOnlyLeftSide)
+
+            for key in rightDirs.keys() - leftDirs.keys():
+                self._addSubtree(rightDirs[key], rightTree, self.dirsOnlyRightSide, self.filesOnlyRightSide)
+
+        self.filesMoreRecentLeftSide, self.filesMoreRecentRightSide = \
+            self._updateMoreRecentFiles(commonFiles)
+
+        renamed = sum(1 for leftPath, rightPath in commonFiles if leftPath != rightPath)
+
+        if renamed:
+            self.log.info("{} fichier(s) associé(s) malgré un nom encodé différemment "
+                "de chaque côté.".format(renamed))
+
+        for directory in (self.dirLeft, self.dirRight):
+            if directory.pathIndex.collisions:
+                self.log.warning("{path} : {count} nom(s) identique(s) après "
+                    "normalisation, comparé(s) sans normalisation.".format(
+                        path=directory,
+                        count=len(directory.pathIndex.collisions)))
+
+        if self.comparator.avoided:
+            self.log.info("{} transfert(s) évité(s) par la comparaison des dates "
+                "à la précision des systèmes de fichiers.".format(self.comparator.avoided))
 
         self.__syncInfosUpdated = True
 
-    def _updateMoreRecentFiles(self, filesToCheck, filesReference):
-        """Renvoie les fichiers plus récents par rapport aux fichiers de référence"""
-        common_files = filesToCheck.keys() - (filesToCheck.keys() - filesReference.keys())
+    def _addSubtree(self, path, tree, dirs, files):
+        """Ajoute un dossier et toute son arborescence aux ensembles dirs et files."""
+        stack = [path]
+
+        while stack:
+            _dir = stack.pop()
+            dirs.add(_dir)
 
-        files = set()
+            subdirs, subfiles = tree[_dir]
+            stack.extend(subdirs)
+            files.update(subfiles)
 
-        for _file in common_files:
-            if filesToCheck[_file]["mdate"] > filesReference[_file]["mdate"]:
-                files.add(_file)
+    def _buildComparator(self):
+        if not self.dirLeft.fs:
+            self.dirLeft.attachFileSystem(self.dirLeft.basepath)
 
-        return files
+        if not self.dirRight.fs:
+            self.dirRight.attachFileSystem(self.dirRight.basepath)
+
+        return compare.MtimeComparator(self.dirLeft.fs, self.dirRight.fs,
+            self.config.mtimeTolerance, self.config.ftpUtcOffset)
+
+    def _updateMoreRecentFiles(self, commonFiles):
+        """Renvoie les fichiers plus récents à gauche et les fichiers plus
+        récents à droite parmi les couples de fichiers communs aux deux
+        dossiers. Chaque fichier est désigné par son chemin de son côté."""
+        leftFiles = self.dirLeft.files
+        rightFiles = self.dirRight.files
+
+        filesLeft = set()
+        filesRight = set()
+
+        for leftPath, rightPath in commonFiles:
+            result = self.comparator.compare(leftFiles[leftPath], rightFiles[rightPath])
+
+            if result > 0:
+                filesLeft.add(leftPath)
+            elif result < 0:
+                filesRight.add(rightPath)
+
+        return filesLeft, filesRight
 
     def _buildFilesListsForSync(self):
         self.log.info("Mode synchronisation.")
@@ -141,78 +342,406 @@ class Sync:
         self.filesToCopy = dict()
         self.filesToCopy["left"] = self.filesOnlyLeftSide.union(
             self.filesMoreRecentLeftSide, 
-            self.filesMoreRecentRightSide)
+            {self.dirLeft.realPath(path) for path in self.filesMoreRecentRightSide})
         self.filesToCopy["right"] = set()
 
     def _doRemoveDirs(self):
         for side, paths in self.dirsToRemove.items():
-            for path in paths:
-                if side == "left":
-                    self.log.debug("[G] {}...".format(path))
-                    self.dirLeft.fs.rmtree(path)
-                elif side == "right":
-                    self.log.debug("[D] {}...".format(path))
-                    self.dirRight.fs.rmtree(path)
+            paths = [path for path in paths
+                if not self._isDone("removeDir", side, path)]
+
+            if paths:
+                self._deletionEngine(side).deleteDirs(paths, 
+                    self._removed("removeDir", side))
 
     def _doRemoveFiles(self):
         for side, paths in self.filesToRemove.items():
-            for path in paths:
-                if side == "left":
-                    self.log.debug("[G] {}...".format(path))
-                    self.dirLeft.fs.delete(path)
-                elif side == "right":
-                    self.log.debug("[D] {}...".format(path))
-                    self.dirRight.fs.delete(path)
+            paths = [path for path in paths
+                if not self._isDone("removeFile", side, path)]
+
+            if paths:
+                self._deletionEngine(side).deleteFiles(paths, 
+                    self._removed("removeFile", side))
+
+    def _deletionEngine(self, side):
+        """Moteur de suppression parallèle du dossier side."""
+        if side not in self._deletionEngines:
+            import deletion
+
+            directory = self.dirLeft if side == "left" else self.dirRight
+
+            # Les fichiers connus par le manifeste ont pu être supprimés par
+            # une synchronisation interrompue
+            self._deletionEngines[side] = deletion.DeletionEngine(
+                directory.fs, self.config.deleteWorkers, self.log,
+                ignoreMissing=directory.manifest is not None)
+
+        return self._deletionEngines[side]
+
+    def _removed(self, action, side):
+        """Renvoie la fonction appelée pour chaque élément supprimé."""
+        prefix = "[G]" if side == "left" else "[D]"
+
+        def callback(path):
+            self.log.debug("{} {}...".format(prefix, path))
+            self._setDone(action, side, path)
+
+        return callback
+
+    def _closeDeletionEngines(self):
+        for side, engine in self._deletionEngines.items():
+            if engine.deleted:
+                self.log.info(engine.report())
+
+            engine.close()
+
+        self._deletionEngines = dict()
 
     def _doCopyDirs(self):
         for side, paths in self.dirsToCopy.items():
-            for path in paths:
+            # Les dossiers parents sont créés avant leurs sous-dossiers
+            for path in sorted(paths):
+                if self._isDone("copyDir", side, path):
+                    continue
+
                 if side == "left":
                     self.log.debug("[G] {}...".format(path))
-                    self.dirRight.fs.makedirs(path)
+                    self.dirRight.fs.makedirs(self.dirRight.realPath(path))
                 elif side == "right":
                     self.log.debug("[D] {}...".format(path))
-                    self.dirLeft.fs.makedirs(path)
+                    self.dirLeft.fs.makedirs(self.dirLeft.realPath(path))
 
-    def _doCopyFiles(self):
-        tz_paris = pytz.timezone("Europe/Paris")
+                self._setDone("copyDir", side, path)
 
+    def _doCopyFiles(self):
         for side, paths in self.filesToCopy.items():
             for path in paths:
+                if self._isDone("copyFile", side, path):
+                    continue
+
                 if side == "left":
                     # Modification de la date de modification pour correspondre
-                    # à celle du fichier source
-                    abs_path = posixpath.join(self.dirLeft.fs.basepath, path)
-
-                    utc_mtime = pytz.utc.localize(
-                        datetime.fromtimestamp(self.dirLeft.fs.stat(abs_path).st_mtime))
-                    local_mtime = utc_mtime.astimezone(tz_paris).timestamp()
+                    # à celle du fichier source, relevée lors du parcours
+                    mtime = self._copiedMdate(path, side)
                     
                     self.log.debug("[G] {}...".format(path))
                     
-                    self.dirRight.fs.write(path, fd_content=self.dirLeft.fs.open(path, "rb"))
-                    self.dirRight.fs.utime(path, (local_mtime, local_mtime))
+                    self._copyFile(self.dirLeft, self.dirRight, path, side)
+                    self.dirRight.fs.utime(self.dirRight.realPath(path), (mtime, mtime))
                     
                 elif side == "right":
                     # Modification de la date de modification pour correspondre
-                    # à celle du fichier source
-                    abs_path = posixpath.join(self.dirRight.fs.basepath, path)
-
-                    utc_mtime = pytz.utc.localize(
-                        datetime.fromtimestamp(self.dirRight.fs.stat(abs_path).st_mtime))
-                    local_mtime = utc_mtime.astimezone(tz_paris).timestamp()
+                    # à celle du fichier source, relevée lors du parcours
+                    mtime = self._copiedMdate(path, side)
                     
                     self.log.debug("[D] {}...".format(path))
                     
-                    self.dirLeft.fs.write(path, fd_content=self.dirRight.fs.open(path, "rb"))
-                    self.dirLeft.fs.utime(path, (local_mtime, local_mtime))
+                    self._copyFile(self.dirRight, self.dirLeft, path, side)
+                    self.dirLeft.fs.utime(self.dirLeft.realPath(path), (mtime, mtime))
+
+                self._setDone("copyFile", side, path)
+
+    def _copiedMdate(self, path, side):
+        """Date de modification du fichier source, exprimée pour le dossier cible."""
+        if side == "left":
+            return self.comparator.convert(self.dirLeft.files[path]["mdate"], "left", "right")
+
+        return self.comparator.convert(self.dirRight.files[path]["mdate"], "right", "left")
+
+    def _copyFile(self, source, target, path, side):
+        """Copie un fichier du dossier source vers le dossier cible.
+
+        Au-delà de config.segmentThreshold octets, un fichier échangé entre un
+        dossier local et un serveur FTP est transféré par segments en
+        parallèle lorsque le serveur le permet. Un transfert interrompu lors
+        d'une exécution précédente reprend à la position enregistrée dans le
+        journal. Le fichier cible garde son nom s'il existe déjà sous un nom
+        encodé différemment.
+        """
+        size = source.files[path]["size"]
+        threshold = self.config.segmentThreshold
+        targetPath = target.realPath(path)
+
+        if self.journal:
+            stat = source.files[path]
+            offset = self._verifiedOffset(source, target, path,
+                self.journal.offset("copyFile", side, path, stat))
+
+            if offset:
+                self.log.debug("Reprise de {path} à {offset} octet(s)...".format(
+                    path=path,
+                    offset=offset))
+
+                fd_content = self.journal.reader(
+                    source.fs.open(path, "rb", rest=offset), 
+                    "copyFile", side, path, offset, stat)
+
+                if target.fs.resume(targetPath, fd_content, offset):
+                    return
+
+                # Reprise impossible : la connexion de données ouverte à la
+                # position de reprise est fermée avant la copie complète
+                fd_content.close()
+
+            self.journal.start("copyFile", side, path, stat)
+
+        if threshold and size >= threshold:
+            if source.fs.segmentedTransfers and target.fs.local:
+                localFilename = posixpath.join(target.fs.basepath, targetPath)
+
+                if source.fs.download(path, localFilename, size, self.config.segments):
+                    return
+
+            elif target.fs.segmentedTransfers and source.fs.local:
+                localFilename = posixpath.join(source.fs.basepath, path)
+
+                if target.fs.upload(localFilename, targetPath, size, self.config.segments):
+                    return
+
+        fd_content = source.fs.open(path, "rb")
+
+        if self.journal:
+            fd_content = self.journal.reader(fd_content, "copyFile", side, path,
+                stat=stat)
+
+        target.fs.write(targetPath, fd_content=fd_content,
+            keepPartial=self.journal is not None)
+
+    def _verifiedOffset(self, source, target, path, offset):
+        """Vérifie la partie déjà transférée d'un fichier interrompu.
+
+        Renvoie la position à partir de laquelle reprendre le transfert, ou 0
+        si le fichier cible est absent ou si la fin de la partie transférée
+        diffère du fichier source.
+        """
+        if not offset:
+            return 0
+
+        targetPath = target.realPath(path)
+        size = target.fs.getsize(targetPath)
+
+        if not size:
+            return 0
+
+        offset = min(offset, size, source.files[path]["size"])
+        length = min(offset, journal.VERIFY_SIZE)
+
+        sourceFd = source.fs.open(path, "rb", rest=offset - length)
+        targetFd = target.fs.open(targetPath, "rb", rest=offset - length)
+
+        try:
+            if sourceFd.read(length) != targetFd.read(length):
+                return 0
+        finally:
+            sourceFd.close()
+            targetFd.close()
+
+        return offset
+
+    def _applyResults(self):
+        """Applique les opérations effectuées aux résultats des parcours."""
+        directories = {"left": self.dirLeft, "right": self.dirRight}
+        others = {"left": self.dirRight, "right": self.dirLeft}
+
+        # Chemins des copies résolus avant de retirer les entrées supprimées
+        # de l'index, comme lors des copies
+        dirsCopied = [(side, path, others[side].realPath(path))
+            for side, paths in self.dirsToCopy.items() for path in paths]
+        filesCopied = [(side, path, others[side].realPath(path))
+            for side, paths in self.filesToCopy.items() for path in paths]
+
+        for side, paths in self.filesToRemove.items():
+            for path in paths:
+                directories[side].forget(path)
+
+        for side, paths in self.dirsToRemove.items():
+            for path in paths:
+                directories[side].forget(path, isdir=True)
+
+        for side, path, targetPath in dirsCopied:
+            others[side].record(targetPath, directories[side].dirs[path], isdir=True)
+
+        for side, path, targetPath in filesCopied:
+            stat = dict(directories[side].files[path])
+            stat["mdate"] = self._copiedMdate(path, side)
+            others[side].record(targetPath, stat)
+
+    def _saveDigests(self):
+        """Enregistre le résultat du parcours du dossier de droite dans le
+        cache s'il est distant."""
+        if not self.dirRight.fs.local:
+            self.digestCache.update(self.dirRight)
+
+        self.digestCache.save()
+
+    def _discardDigests(self):
+        """Supprime du cache le dossier de droite avant sa modification.
+
+        Une synchronisation interrompue laisserait sinon dans le cache un
+        état du dossier qui n'est plus le sien.
+        """
+        self.digestCache.discard(self.dirRight.basepath).save()
+
+    def _changesRight(self):
+        """Retourne vrai si la synchronisation modifie le dossier de droite."""
+        return bool(self.filesToRemove["right"] or self.dirsToRemove["right"]
+            or self.filesToCopy["left"] or self.dirsToCopy["left"])
+
+    def _discardManifest(self):
+        """Supprime le manifeste du dossier de droite avant sa modification.
+
+        Le nouveau manifeste n'est envoyé qu'en fin de synchronisation.
+        """
+        if not self.dirRight.fs.local:
+            import manifest
+
+            manifest.Manifest.discard(self.dirRight.fs)
+
+    def _saveManifest(self):
+        """Envoie le manifeste du dossier de droite s'il est distant."""
+        if self.dirRight.fs.local:
+            return
+
+        import manifest
+
+        previous = self.dirRight.manifest
+        hashes = dict()
+
+        if self.config.manifestHashes:
+            copied = {self.dirRight.realPath(path) for path in self.filesToCopy["left"]}
+
+            for path in self.dirRight.files:
+                if path in copied:
+                    hashes[path] = manifest.fileHash(self.dirLeft.fs, self.dirLeft.realPath(path))
+                elif previous and path in previous.hashes:
+                    hashes[path] = previous.hashes[path]
+
+        manifest.Manifest(
+            self.dirRight.files, 
+            self.dirRight.dirs, 
+            hashes, 
+            self.pathFilter.rules).save(self.dirRight.fs)
+
+    def _openJournal(self):
+        """Ouvre le journal des opérations s'il est configuré."""
+        if not self.config.journalFile:
+            return None
+
+        header = {
+            "dirLeft": filesystem.hidePassword(self.config.dirLeft),
+            "dirRight": filesystem.hidePassword(self.config.dirRight),
+            "mirroring": self.config.mirroring
+        }
+
+        return journal.SyncJournal(self.config.journalFile, header).open()
+
+    def _applyJournal(self):
+        """Force le sens des copies interrompues lors d'une exécution précédente.
+
+        Le fichier partiellement copié est plus récent que sa source, il ne
+        doit donc ni être recopié dans l'autre sens ni être supprimé. Une
+        source modifiée depuis l'interruption est comparée normalement.
+        """
+        directories = {"left": self.dirLeft, "right": self.dirRight}
+
+        for side, path in self.journal.pending("copyFile"):
+            other = "right" if side == "left" else "left"
+
+            if path not in directories[side].files:
+                continue
+
+            if self.journal.state("copyFile", side, path,
+                    directories[side].files[path]) is None:
+                continue
+
+            self.filesToCopy[side].add(path)
+            self.filesToCopy[other].discard(directories[other].realPath(path))
+            self.filesToRemove[other].discard(directories[other].realPath(path))
+
+    def _buildPathIndex(self):
+        return pathindex.PathIndex(self.config.unicodeForm, self.config.caseFold)
+
+    def _profileDirectory(self, directory, side):
+        """Mesure le parcours d'un dossier et les appels à son système de fichiers."""
+        if not directory.fs:
+            directory.attachFileSystem(directory.basepath)
+
+        self.profiler.instrument(directory, side, ["scan"])
+        self.profiler.instrument(directory.fs, side + ".fs")
+
+    def _reportProfile(self):
+        """Affiche les régions les plus coûteuses et enregistre les fichiers
+        de profilage."""
+        self.profiler.stop()
+
+        self.log.info("Profilage (régions triées par temps propre) :\n" +
+            self.profiler.report())
+
+        stacksFilename = self.config.profile + ".folded"
+        self.profiler.writeStacks(stacksFilename)
+        self.log.info("Piles pour flamegraph : " + stacksFilename)
+
+        if self.profiler.cProfile:
+            dumpFilename = self.config.profile + ".prof"
+            self.profiler.dump(dumpFilename)
+            self.log.info("Statistiques cProfile : " + dumpFilename)
+
+    def _isDone(self, action, side, path):
+        return self.journal is not None and self.journal.isDone(action, side, path,
+            self._journalStat(action, side, path))
+
+    def _setDone(self, action, side, path):
+        if self.journal:
+            self.journal.done(action, side, path, self._journalStat(action, side, path))
+
+    def _journalStat(self, action, side, path):
+        """Taille et date relevées lors du parcours de l'élément concerné par
+        une opération du journal."""
+        directory = self.dirLeft if side == "left" else self.dirRight
+
+        if action.endswith("Dir"):
+            return directory.dirs.get(path)
+
+        return directory.files.get(path)
 
 class SyncConfiguration:
     """Classe stockant les différents paramètres de synchronisation"""
 
-    def __init__(self, parser=None):
+    def __init__(self, parser=None, argv=None, **options):
+        self.debug = False
+        self.logpath = os.path.abspath("sync.log")
+        self.mirroring = False
+        self.logActivated = False
+        self.preserveDirRight = False
+        self.dirLeft = None
+        self.dirRight = None
+        self.filterFile = None
+        self.filterRules = list()
+        self.jobFile = None
+        self.concurrency = None
+        self.segmentThreshold = 0
+        self.segments = 4
+        self.journalFile = None
+        self.digestFile = None
+        self.deleteWorkers = 4
+        self.manifest = False
+        self.manifestHashes = False
+        self.mtimeTolerance = 0
+        self.ftpUtcOffset = 0
+        self.scanWorkers = 1
+        self.profile = None
+        self.profileCProfile = False
+        self.unicodeForm = "NFC"
+        self.caseFold = False
+
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise TypeError("Option de synchronisation inconnue : " + name)
+
+            setattr(self, name, value)
+
         if parser:
-            self.processArgs(parser)
+            self.processArgs(parser, argv)
 
     def __str__(self):
         infos =""
@@ -226,22 +755,65 @@ class SyncConfiguration:
         if self.mirroring:
             infos = infos + "Mode miroir activé.\n"
 
-        infos = infos + "Dossier gauche : " + self.dirLeft + "\n"\
-            + "Dossier droite : " + self.dirRight + "\n"
+        if self.jobFile:
+            infos = infos + "Fichier de tâches : " + self.jobFile + "\n"
+        else:
+            infos = infos + "Dossier gauche : " + self.dirLeft + "\n"\
+                + "Dossier droite : " + self.dirRight + "\n"
 
         if self.mirroring and self.preserveDirRight:
             infos = infos + \
                 "Les fichiers n'existant que dans le dossier de droite " + \
                 "ne seront pas supprimés.\n"
 
+        if self.filterFile:
+            infos = infos + "Fichier de filtres : " + self.filterFile + "\n"
+
+        if self.filterRules:
+            infos = infos + "Filtres : " + ", ".join(self.filterRules) + "\n"
+
+        if self.journalFile:
+            infos = infos + "Journal de reprise : " + self.journalFile + "\n"
+
+        if self.digestFile:
+            infos = infos + "Cache des parcours : " + self.digestFile + "\n"
+
+        if self.manifest:
+            infos = infos + "Manifeste du dossier distant activé.\n"
+
+        if self.segmentThreshold:
+            infos = infos + "Transferts segmentés au-delà de {:.0f}Mo ({} segments).\n".format(
+                self.segmentThreshold / 1048576, self.segments)
+
+        if self.scanWorkers > 1:
+            infos = infos + "Parcours des dossiers locaux : {} processus.\n".format(
+                self.scanWorkers)
+
+        if not self.unicodeForm:
+            infos = infos + "Noms comparés sans normalisation Unicode.\n"
+
+        if self.caseFold:
+            infos = infos + "Noms comparés sans tenir compte de la casse.\n"
+
+        if self.profile:
+            infos = infos + "Profilage activé : " + self.profile + ".*\n"
+
+        if self.mtimeTolerance:
+            infos = infos + "Tolérance sur les dates de modification : {:g}s.\n".format(
+                self.mtimeTolerance)
+
+        if self.ftpUtcOffset:
+            infos = infos + "Décalage horaire du serveur FTP : {:+g}h.\n".format(
+                self.ftpUtcOffset)
+
         if infos[-1] == "\n":
             infos = infos[:-1]
     
         return infos
 
-    def processArgs(self, parser):
+    def processArgs(self, parser, argv=None):
         """Interprète les arguments de la ligne de commande."""
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
 
         self.debug = args.debug
         self.logpath = os.path.abspath(args.logpath)
@@ -250,13 +822,91 @@ class SyncConfiguration:
         self.preserveDirRight = args.preserve_dirright
         self.dirLeft = args.dirleft
         self.dirRight = args.dirright
+        self.filterFile = args.filter_file
+        self.filterRules = args.filter_rules or list()
+        self.jobFile = args.job_file
+        self.concurrency = args.concurrency
+        self.segmentThreshold = int(args.segment_threshold * 1048576)
+        self.segments = args.segments
+        self.journalFile = args.journal_file
+        self.digestFile = args.digest_file
+        self.deleteWorkers = args.delete_workers
+        self.manifest = args.manifest or args.manifest_hashes
+        self.manifestHashes = args.manifest_hashes
+        self.mtimeTolerance = args.mtime_tolerance
+        self.ftpUtcOffset = args.ftp_utc_offset
+        self.scanWorkers = args.scan_workers or os.cpu_count() or 1
+        self.profileCProfile = args.profile_cprofile
+        self.profile = args.profile or ("sync-profile" if args.profile_cprofile else None)
+        self.unicodeForm = None if args.unicode_form == "none" else args.unicode_form
+        self.caseFold = args.case_fold
+
+        if not self.jobFile and not (self.dirLeft and self.dirRight):
+            parser.error("les paramètres dirleft et dirright sont requis.")
 
         return self
 
+    def jobOptions(self):
+        """Options de synchronisation communes aux tâches d'un fichier.
+
+        Seules les options modifiées par rapport aux valeurs par défaut sont
+        renvoyées, afin de ne pas masquer les options du fichier de tâches.
+        """
+        defaults = SyncConfiguration()
+        options = {
+            "mirroring": self.mirroring,
+            "preserveDirRight": self.preserveDirRight,
+            "filterFile": self.filterFile,
+            "filterRules": self.filterRules,
+            "segmentThreshold": self.segmentThreshold,
+            "segments": self.segments,
+            "deleteWorkers": self.deleteWorkers,
+            "manifest": self.manifest,
+            "manifestHashes": self.manifestHashes,
+            "mtimeTolerance": self.mtimeTolerance,
+            "ftpUtcOffset": self.ftpUtcOffset,
+            "scanWorkers": self.scanWorkers,
+            "unicodeForm": self.unicodeForm,
+            "caseFold": self.caseFold
+        }
+
+        return {name: value for name, value in options.items()
+            if value != getattr(defaults, name)}
+
+    def buildPathFilter(self):
+        """Construit le filtre des chemins à partir des règles configurées.
+
+        Les règles du fichier de filtres sont chargées en premier, celles de
+        la ligne de commande sont ajoutées ensuite et sont donc prioritaires.
+        """
+        pathFilter = filters.PathFilter()
+
+        if self.filterFile:
+            pathFilter.load(self.filterFile)
+
+        for rule in self.filterRules:
+            pathFilter.addRule(rule)
+
+        return pathFilter.compile()
+
 class SyncDirectory:
-    def __init__(self, basepath):
+    def __init__(self, basepath, pathFilter=None, digestCache=None, useManifest=False,
+            scanWorkers=1, pathIndex=None):
         self.fs = None
         self.basepath = basepath
+        self.pathFilter = pathFilter
+        self.digestCache = digestCache
+        self.useManifest = useManifest
+        self.scanWorkers = scanWorkers
+        self.pathIndex = pathIndex or pathindex.PathIndex(None)
+        self.mtimeKey = None
+        self.manifest = None
+        self._dirs = dict()
+        self._files = dict()
+        self._listings = dict()
+        self._digests = None
+        self._tree = None
+        self._scanned = False
 
     def __str__(self):
         return self.basepath
@@ -268,6 +918,14 @@ class SyncDirectory:
             return self.__files()
         elif name == "size":
             return self.__size()
+        elif name == "digests":
+            return self.__digests()
+        elif name == "tree":
+            return self.__tree()
+        elif name == "listings":
+            return self._listings
+        elif name == "index":
+            return self.__index()
         else:
             raise AttributeError()
 
@@ -280,7 +938,7 @@ class SyncDirectory:
         - "size" : taille du dossier en octet
         - "mdate": date de modification du dossier en timestamp UTC
         """
-        if not self._dirs.keys():
+        if not self._scanned:
             self.scan()
 
         return self._dirs
@@ -294,7 +952,7 @@ class SyncDirectory:
         - "size" : taille du fichier en octet
         - "mdate": date de modification du fichier en timestamp UTC
         """
-        if not self._files.keys():
+        if not self._scanned:
             self.scan()
 
         return self._files
@@ -309,17 +967,170 @@ class SyncDirectory:
 
         return size
 
+    def __index(self):
+        """Index des chemins normalisés, construit par le parcours."""
+        if not self._scanned:
+            self.scan()
+
+        return self.pathIndex
+
+    def __digests(self):
+        """Empreintes agrégées des dossiers.
+
+        Le renvoi se fait sous la forme d'un dictionnaire dont la clé est le
+        chemin relatif du dossier ("" pour la racine) et la valeur un tuple
+        (nombre d'entrées, taille totale, empreinte) de son arborescence.
+        """
+        if self._digests is None:
+            import digests
+
+            self._digests, self._tree = digests.computeDigests(self.files, self.dirs,
+                self.mtimeKey)
+
+        return self._digests
+
+    def __tree(self):
+        """Sous-dossiers et fichiers directs de chaque dossier."""
+        if self._tree is None:
+            import digests
+
+            self._digests, self._tree = digests.computeDigests(self.files, self.dirs,
+                self.mtimeKey)
+
+        return self._tree
+
+    def setMtimeKey(self, mtimeKey):
+        """Définit la normalisation des dates de modification utilisée par les
+        empreintes."""
+        self.mtimeKey = mtimeKey
+        self._digests = None
+        self._tree = None
+
     def attachFileSystem(self, path):
         self.fs = filesystem.getFileSystem(path)
 
+        if self.fs is None:
+            raise ValueError("Format de chemin non pris en charge : '{}'.".format(
+                filesystem.hidePassword(path)))
+
+    def record(self, path, stat, isdir=False):
+        """Enregistre une entrée créée ou modifiée pendant la synchronisation."""
+        if isdir:
+            self._dirs[path] = dict(stat)
+        else:
+            self._files[path] = dict(stat)
+
+        self.pathIndex.add(path)
+        self._invalidate(path if isdir else posixpath.dirname(path))
+
+    def forget(self, path, isdir=False):
+        """Retire une entrée supprimée pendant la synchronisation."""
+        if isdir:
+            prefix = path + "/"
+
+            for _dir in [_dir for _dir in self._dirs if _dir.startswith(prefix)]:
+                del self._dirs[_dir]
+                self._listings.pop(_dir, None)
+                self.pathIndex.discard(_dir)
+
+            for _file in [_file for _file in self._files if _file.startswith(prefix)]:
+                del self._files[_file]
+                self.pathIndex.discard(_file)
+
+            self._dirs.pop(path, None)
+            self._listings.pop(path, None)
+        else:
+            self._files.pop(path, None)
+
+        self.pathIndex.discard(path)
+
+        self._invalidate(posixpath.dirname(path))
+
+    def _invalidate(self, path):
+        """Oublie le listing du dossier et de ses parents et les empreintes."""
+        while True:
+            self._listings[path] = None
+
+            if not path:
+                break
+
+            path = posixpath.dirname(path)
+
+        self._digests = None
+        self._tree = None
+
+    def close(self):
+        if self.fs:
+            self.fs.close()
+            self.fs = None
+
     def scan(self):
+        """Parcourt le dossier puis indexe ses chemins normalisés."""
+        self._scanEntries()
+        self.pathIndex.build(list(self._dirs) + list(self._files))
+        self._scanned = True
+
+        return self
+
+    def key(self, path):
+        """Clé de comparaison d'un chemin du dossier avec ceux de l'autre dossier."""
+        return self.pathIndex.key(path)
+
+    def realPath(self, path):
+        """Chemin réel dans ce dossier d'un chemin de l'autre dossier."""
+        return self.pathIndex.resolve(path)
+
+    def _scanEntries(self):
         if not self.fs:
             self.attachFileSystem(self.basepath)
         
         self._dirs = dict()
         self._files = dict()
+        self._listings = dict()
+        self._digests = None
+        self._tree = None
+
+        # Un dossier absent serait parcouru comme un dossier vide : en mode
+        # miroir, tout le contenu de l'autre dossier serait supprimé
+        if not self.fs.isdir(""):
+            raise IOError("Le dossier '{}' n'existe pas.".format(self.basepath))
+
+        if self.useManifest and not self.fs.local and self._loadManifest():
+            return
+
+        if self.fs.local and self.scanWorkers > 1:
+            import scanner
+
+            self._dirs, self._files = scanner.LocalScanner(
+                self.fs.basepath, self.pathFilter, self.scanWorkers).scan()
+
+            return
+
+        # Le cache des parcours n'est utilisé que pour les dossiers distants,
+        # dont le parcours est coûteux
+        cached = None
+        listings = self.digestCache is not None and not self.fs.local
+
+        if listings:
+            import digests
+
+            cached = self.digestCache.get(self.basepath)
 
         for root, _dirs, _files in self.fs.walk(self.fs.basepath):
+            relroot = posixpath.relpath(root.replace("\\", "/"), self.fs.basepath)
+
+            if relroot == ".":
+                relroot = ""
+
+            # Les dossiers exclus sont retirés de la liste en place afin que
+            # walk ne les parcoure pas
+            if self.pathFilter:
+                _dirs[:] = [_dir for _dir in _dirs
+                    if not self.pathFilter.excludes(
+                        posixpath.join(relroot, _dir), isdir=True)]
+
+            entries = list()
+
             for _dir in _dirs:
                 path = os.path.join(root, _dir).replace("\\", "/")
                 
@@ -331,8 +1142,13 @@ class SyncDirectory:
                     "size": stat.st_size,
                     "mdate": stat.st_mtime
                 }
+                entries.append((_dir, "d", stat.st_size, stat.st_mtime))
 
             for _file in _files:
+                if self.pathFilter and self.pathFilter.excludes(
+                        posixpath.join(relroot, _file)):
+                    continue
+
                 path = os.path.join(root, _file).replace("\\", "/")
 
                 stat = self.fs.stat(path)
@@ -343,18 +1159,56 @@ class SyncDirectory:
                     "size": stat.st_size,
                     "mdate": stat.st_mtime
                 }
-        
-        return self
+                entries.append((_file, "f", stat.st_size, stat.st_mtime))
 
-print("""
-SYNC 1.0 - Script de synchronisation entre deux dossiers
---------------------------------------------------------""")
+            if not listings:
+                continue
+
+            self._listings[relroot] = digests.listingHash(entries)
+
+            # Listing identique à l'exécution précédente : le contenu des
+            # sous-dossiers est repris du cache sans les parcourir
+            if cached and cached.listing(relroot) == self._listings[relroot]:
+                for _dir in _dirs:
+                    _dir = posixpath.join(relroot, _dir)
+                    self._listings[_dir] = cached.listing(_dir)
 
-# Configuration des paramètres de la ligne de commande
-parser = argparse.ArgumentParser(prog="sync",
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    description="Synchronise le contenu de deux dossiers (locaux ou FTP).",
-    epilog="""
+                    for path, isdir, stat in cached.subtree(_dir):
+                        if isdir:
+                            self._dirs[path] = stat
+                            self._listings[path] = cached.listing(path)
+                        else:
+                            self._files[path] = stat
+
+                _dirs[:] = list()
+
+    def _loadManifest(self):
+        """Reprend l'état du dossier depuis son manifeste, après vérification
+        de quelques listings. Renvoie faux si le dossier doit être parcouru."""
+        import manifest
+
+        rules = self.pathFilter.rules if self.pathFilter else list()
+        self.manifest = manifest.Manifest.load(self.fs, rules)
+
+        if not self.manifest:
+            return False
+
+        if not self.manifest.spotCheck(self.fs, self.pathFilter):
+            self.manifest = None
+
+            return False
+
+        self._files = {path: dict(stat) for path, stat in self.manifest.files.items()}
+        self._dirs = {path: dict(stat) for path, stat in self.manifest.dirs.items()}
+
+        return True
+
+def buildParser():
+    """Construit l'analyseur des paramètres de la ligne de commande."""
+    parser = argparse.ArgumentParser(prog="sync",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Synchronise le contenu de deux dossiers (locaux ou FTP).",
+        epilog="""
 Les chemins réseaux de type \\\\serveur\\partage ne sont pas supportés. Pour les
 dossiers hébergés sur un serveur FTP, le paramètre dirleft ou dirright doit
 respecter le format d'url suivante : 
@@ -369,118 +1223,361 @@ base sur les règles suivantes :
   celui dont la taille est la plus grosse.
 - Si les dates de modification et la taille sont égales, les fichiers sont
   considérés comme identiques et ne seront pas synchronisés.
+Les dates de modification sont exprimées en UTC et comparées à la précision du
+système de fichiers le moins précis, à la tolérance --mtime-tolerance près.
 """)
 
-parser.add_argument("dirleft", help="Chemin absolu vers le dossier de gauche.")
-parser.add_argument("dirright", help="Chemin absolu vers le dossier de droite.")
-parser.add_argument(
-    "--debug",
-    action="store_true",
-    dest="debug",
-    help="""
+    parser.add_argument(
+        "dirleft",
+        nargs="?",
+        help="Chemin absolu vers le dossier de gauche.")
+    parser.add_argument(
+        "dirright",
+        nargs="?",
+        help="Chemin absolu vers le dossier de droite.")
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        dest="debug",
+        help="""
 Ajoute des informations supplémentaires dans le fichier journal. L'option
 --no-log est alors ignorée.""")
-parser.add_argument(
-    "-l",
-    "--log", 
-    dest="logpath", 
-    metavar="FILE",
-    default="sync.log",
-    help="""
+    parser.add_argument(
+        "-l",
+        "--log", 
+        dest="logpath", 
+        metavar="FILE",
+        default="sync.log",
+        help="""
 Chemin vers le fichier journal. Par défaut, le fichier sync.log sera créé dans
 le répertoire courant.""")
-parser.add_argument(
-    "-m", 
-    "--mirroring", 
-    dest="mirroring", 
-    action="store_true",
-    help="""
+    parser.add_argument(
+        "-m", 
+        "--mirroring", 
+        dest="mirroring", 
+        action="store_true",
+        help="""
 Exécute la synchronisation en mode mirroir. Tout le contenu de dirleft est copié
 dans dirright. Les fichiers qui existaient uniquement dans dirright sont 
 supprimés.""")
-parser.add_argument(
-    "--no-log", 
-    dest="log_activated", 
-    action="store_false",
-    help="Aucun fichier journal ne sera créé.")
-parser.add_argument(
-    "--preserve-dirright", 
-    action="store_true",
-    dest="preserve_dirright", 
-    help="""
+    parser.add_argument(
+        "--no-log", 
+        dest="log_activated", 
+        action="store_false",
+        help="Aucun fichier journal ne sera créé.")
+    parser.add_argument(
+        "--preserve-dirright", 
+        action="store_true",
+        dest="preserve_dirright", 
+        help="""
 Dans le cas d'une copie en mode miroir, les fichiers existant dans dirright et
 absent de dirleft ne sont pas supprimés.""")
-parser.add_argument("--version", action="version", version="%(prog)s 1.0")
-
-print("\n> Analyse des paramètres de la ligne de commande...")
-config = SyncConfiguration(parser)
-print("Terminé.")
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        dest="filter_rules",
+        metavar="PATTERN",
+        help="""
+Exclut les chemins correspondant au motif (syntaxe .gitignore, ou expression
+régulière préfixée par "re:"). Les dossiers exclus ne sont pas parcourus.
+L'option peut être répétée.""")
+    parser.add_argument(
+        "--include",
+        action="append",
+        dest="filter_rules",
+        metavar="PATTERN",
+        type=lambda pattern: "!" + pattern,
+        help="""
+Ré-inclut les chemins correspondant au motif. Comme pour .gitignore, la
+dernière règle correspondante l'emporte. L'option peut être répétée.""")
+    parser.add_argument(
+        "--filter-from",
+        dest="filter_file",
+        metavar="FILE",
+        help="""
+Fichier de règles d'inclusion/exclusion au format .gitignore. Les règles
+passées par --exclude et --include sont appliquées après celles du fichier.""")
+    parser.add_argument(
+        "--jobs",
+        dest="job_file",
+        metavar="FILE",
+        help="""
+Fichier de tâches (JSON ou YAML) listant plusieurs paires dirLeft/dirRight et
+leurs options. Les paramètres dirleft et dirright sont alors ignorés. Les
+options passées en ligne de commande servent de valeurs par défaut, remplacées
+par les options communes du fichier puis par celles de chaque tâche.""")
+    parser.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        metavar="N",
+        type=int,
+        help="""
+Nombre maximal de synchronisations simultanées en mode fichier de tâches.
+Par défaut, la valeur du fichier de tâches ou 4.""")
+    parser.add_argument(
+        "--segment-threshold",
+        dest="segment_threshold",
+        metavar="MO",
+        type=float,
+        default=0,
+        help="""
+Taille (en Mo) à partir de laquelle un fichier échangé avec un serveur FTP est
+transféré par segments sur plusieurs connexions en parallèle. Par défaut, les
+transferts segmentés sont désactivés.""")
+    parser.add_argument(
+        "--segments",
+        dest="segments",
+        metavar="N",
+        type=int,
+        default=4,
+        help="Nombre de segments (et de connexions) par transfert segmenté.")
+    parser.add_argument(
+        "--journal",
+        dest="journal_file",
+        metavar="FILE",
+        help="""
+Journal des opérations effectuées. Si une synchronisation échoue, sa
+relance avec le même journal ignore les opérations déjà terminées et reprend
+les transferts interrompus. Le journal est supprimé en fin de
+synchronisation.""")
+    parser.add_argument(
+        "--digest-cache",
+        dest="digest_file",
+        metavar="FILE",
+        help="""
+Fichier conservant les résultats du parcours du dossier de droite (FTP) et
+leurs empreintes. Au parcours suivant, un dossier dont le listing n'a pas
+changé n'est pas parcouru, son contenu étant repris du cache. Un fichier
+remplacé sur place ne modifie pas la date de son dossier et n'est donc pas
+détecté : à réserver, comme --manifest, aux dossiers modifiés uniquement par
+cet outil.""")
+    parser.add_argument(
+        "--delete-workers",
+        dest="delete_workers",
+        metavar="N",
+        type=int,
+        default=4,
+        help="""
+Nombre de suppressions simultanées (et de connexions FTP) pour les fichiers et
+dossiers à supprimer. Par défaut, 4.""")
+    parser.add_argument(
+        "--manifest",
+        dest="manifest",
+        action="store_true",
+        help="""
+Enregistre l'état du dossier de droite (FTP) dans un manifeste compressé à sa
+racine après chaque synchronisation. À l'exécution suivante, le manifeste
+remplace le parcours du dossier après vérification de quelques listings. À
+réserver aux dossiers modifiés uniquement par cet outil.""")
+    parser.add_argument(
+        "--manifest-hashes",
+        dest="manifest_hashes",
+        action="store_true",
+        help="""
+Comme --manifest, en ajoutant au manifeste l'empreinte SHA-1 des fichiers
+copiés.""")
+    parser.add_argument(
+        "--mtime-tolerance",
+        dest="mtime_tolerance",
+        metavar="SECONDS",
+        type=float,
+        default=0,
+        help="""
+Écart maximal, en secondes, entre les dates de modification de deux fichiers
+considérées comme identiques. Les dates sont de toute façon comparées à la
+précision du système de fichiers le moins précis (la seconde pour un serveur
+FTP). Par défaut, 0.""")
+    parser.add_argument(
+        "--ftp-utc-offset",
+        dest="ftp_utc_offset",
+        metavar="HOURS",
+        type=float,
+        default=0,
+        help="""
+Décalage horaire, en heures, des dates de modification renvoyées par le
+serveur FTP lorsqu'il ne les exprime pas en UTC. Par défaut, 0.""")
+    parser.add_argument(
+        "--scan-workers",
+        dest="scan_workers",
+        metavar="N",
+        type=int,
+        default=1,
+        help="""
+Nombre de processus parcourant les dossiers locaux, chacun prenant en charge
+une partie des sous-dossiers. 0 utilise un processus par cœur. Par défaut, 1
+(parcours dans le processus principal).""")
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        metavar="PREFIX",
+        nargs="?",
+        const="sync-profile",
+        help="""
+Mesure le temps passé dans chaque phase de la synchronisation et dans chaque
+appel aux systèmes de fichiers. Le tableau des régions les plus coûteuses est
+affiché en fin de synchronisation et les piles sont enregistrées dans
+PREFIX.folded, au format des outils de flamegraph. Par défaut, PREFIX vaut
+sync-profile. Sans effet avec --jobs.""")
+    parser.add_argument(
+        "--profile-cprofile",
+        dest="profile_cprofile",
+        action="store_true",
+        help="""
+Comme --profile, en profilant également le thread principal avec cProfile.
+Les statistiques sont enregistrées dans PREFIX.prof (lisible par pstats).""")
+    parser.add_argument(
+        "--unicode-form",
+        dest="unicode_form",
+        choices=["NFC", "NFD", "none"],
+        default="NFC",
+        help="""
+Forme de normalisation Unicode appliquée aux noms avant de comparer les deux
+dossiers, afin d'associer un fichier dont le nom est encodé différemment de
+chaque côté (noms NFD créés sous macOS par exemple). Le fichier garde son nom
+existant de chaque côté. "none" compare les noms tels quels. Par défaut, NFC.""")
+    parser.add_argument(
+        "--ignore-case",
+        dest="case_fold",
+        action="store_true",
+        help="""
+Compare les noms sans tenir compte de la casse, pour les dossiers hébergés sur
+un système de fichiers qui l'ignore (Windows).""")
+    parser.add_argument("--version", action="version", version="%(prog)s 1.0")
+
+    return parser
+
+def setupLogging(config, name=__name__):
+    """Initialise le journal à partir de la configuration."""
+    log = logging.getLogger(name)
+
+    if config.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+
+    consoleLog = logging.StreamHandler()
+    consoleLog.setFormatter(logging.Formatter("%(message)s"))
+
+    if config.logActivated:
+        fileLog = logging.FileHandler(config.logpath, mode="w")
+        fileLog.setFormatter(
+            logging.Formatter("%(asctime)s\t%(levelname)s\t%(message)s"))
+        log.addHandler(fileLog)
+
+    log.addHandler(consoleLog)
+
+    return log
+
+def synchronize(dirLeft, dirRight, log=None, **options):
+    """Synchronise deux dossiers sans passer par la ligne de commande.
+
+    Les options acceptées sont les attributs de SyncConfiguration (mirroring,
+    preserveDirRight, filterRules...). L'objet Sync est renvoyé une fois la
+    synchronisation terminée et les accès aux dossiers fermés.
+    """
+    config = SyncConfiguration(dirLeft=dirLeft, dirRight=dirRight, **options)
+    sync = Sync(config, log)
+
+    try:
+        return sync.sync()
+    finally:
+        sync.close()
+
+def runJobs(config, log):
+    """Exécute les synchronisations décrites par le fichier de tâches."""
+    import jobs
+
+    print("\n> Chargement du fichier de tâches...")
+    runner = jobs.JobRunner.fromFile(
+        config.jobFile, 
+        config.concurrency, 
+        config.jobOptions(),
+        log)
+    print("Terminé.")
+
+    print("\n> Synchronisation de {} paire(s) de dossiers...".format(
+        len(runner.jobs)))
+    runner.run()
+    print("Terminé.")
+
+    print("\n> Rapport")
+    log.info(runner.report())
+
+    if any(job.error for job in runner.jobs):
+        return 1
+
+    return 0
+
+def main(argv=None):
+    print("""
+SYNC 1.0 - Script de synchronisation entre deux dossiers
+--------------------------------------------------------""")
 
-### Initialisation de la log
-print("\n> Initialisation du module de log...")
-log = logging.getLogger(__name__)
+    parser = buildParser()
 
-if config.debug:
-    log.setLevel(logging.DEBUG)
-else:
-    log.setLevel(logging.INFO)
+    print("\n> Analyse des paramètres de la ligne de commande...")
+    config = SyncConfiguration(parser, argv)
+    print("Terminé.")
 
-consoleLog = logging.StreamHandler()
-consoleLog.setFormatter(logging.Formatter("%(message)s"))
+    ### Initialisation de la log
+    print("\n> Initialisation du module de log...")
+    log = setupLogging(config)
+    print("Terminé.")
 
-if config.logActivated:
-    fileLog = logging.FileHandler(config.logpath, mode="w")
-    fileLog.setFormatter(
-        logging.Formatter("%(asctime)s\t%(levelname)s\t%(message)s"))
-    log.addHandler(fileLog)
+    print("\n> Configuration du module de synchronisation")
+    print(config)
 
-log.addHandler(consoleLog)
+    if config.jobFile:
+        return runJobs(config, log)
 
-print("Terminé.")
+    ### Synchronisation des fichiers
+    sync = Sync(config, log)
 
-print("\n> Configuration du module de synchronisation")
-print(config)
+    try:
+        # Mise a jour des statistiques du dossier de gauche
+        print("\n> Parcours de l'arborescence du dossier de gauche ({})...".format(
+            sync.dirLeft))
+        sync.dirLeft.scan()
 
-### Synchronisation des fichiers
-sync = Sync(config, log)
+        log.info("Le dossier '{path}' contient {nfiles} fichier(s) dans {ndirs} \
+répertoire(s) ({size:.2f}Mo).".format(
+            path=sync.dirLeft,
+            nfiles=len(sync.dirLeft.files), 
+            ndirs=len(sync.dirLeft.dirs),
+            size=sync.dirLeft.size / 1048576))
 
-# Mise a jour des statistiques du dossier de gauche
-print("\n> Parcours de l'arborescence du dossier de gauche ({})...".format(
-    sync.dirLeft))
-sync.dirLeft.scan()
+        # Mise a jour des statistiques du dossier de droite
+        print("\n> Parcours de l'arborescence du dossier de droite ({})...".format(
+            sync.dirRight))
+        sync.dirRight.scan()
 
-log.info("Le dossier '{path}' contient {nfiles} fichier(s) dans {ndirs} \
+        log.info("Le dossier '{path}' contient {nfiles} fichier(s) dans {ndirs} \
 répertoire(s) ({size:.2f}Mo).".format(
-    path=sync.dirLeft,
-    nfiles=len(sync.dirLeft.files), 
-    ndirs=len(sync.dirLeft.dirs),
-    size=sync.dirLeft.size / 1048576))
+            path=sync.dirRight,
+            nfiles=len(sync.dirRight.files), 
+            ndirs=len(sync.dirRight.dirs),
+            size=sync.dirRight.size / 1048576))
+
+        # Mise à jour des informations de synchronisation
+        print("\n> Mise à jour des informations de synchronisation...")
+        sync.updateSyncInfos()
+        print("Terminé.")
+
+        # Synchronisation des dossiers
+        print("\n> Synchronisation des dossiers...")
+
+        try:
+            sync.sync()
+        except Exception as e:
+            log.error("{}".format(e))
+            raise
+        
+        print("Terminé.")
+        log.info("Synchronisation terminée.")
 
-# Mise a jour des statistiques du dossier de droite
-print("\n> Parcours de l'arborescence du dossier de droite ({})...".format(
-    sync.dirRight))
-sync.dirRight.scan()
+        return 0
+    finally:
+        sync.close()
 
-log.info("Le dossier '{path}' contient {nfiles} fichier(s) dans {ndirs} \
-répertoire(s) ({size:.2f}Mo).".format(
-    path=sync.dirRight,
-    nfiles=len(sync.dirRight.files), 
-    ndirs=len(sync.dirRight.dirs),
-    size=sync.dirRight.size / 1048576))
-
-# Mise à jour des informations de synchronisation
-print("\n> Mise à jour des informations de synchronisation...")
-sync.updateSyncInfos()
-print("Terminé.")
-
-# Synchronisation des dossiers
-print("\n> Synchronisation des dossiers...")
-
-try:
-    sync.sync()
-except Exception as e:
-    log.error("{}".format(e))
-    raise
-    
-print("Terminé.")
-log.info("Synchronisation terminée.")
+if __name__ == "__main__":
+    sys.exit(main())